@@ -0,0 +1,52 @@
+import time
+
+from flask import Flask, Response, g, jsonify, request
+from flask_cors import CORS
+
+import metrics
+
+
+# Application factory for every endpoint: /query, /download_and_process, /jobs and
+# /batch from proxy_server, /process from process_nc_file, /ready and /metrics.
+# Every request's latency goes to the metrics registry, and with PROFILE_SLOW_SECONDS
+# set, slow requests are profiled (see metrics).
+
+def create_app():
+    import process_nc_file
+    import proxy_server
+
+    app = Flask(__name__)
+    CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['X-Granule-Id'])
+    app.register_blueprint(proxy_server.bp)
+    app.register_blueprint(process_nc_file.bp)
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        g.profiler = metrics.Profiler(f'{request.method} {request.path}').start()
+
+    @app.after_request
+    def record_request(response):
+        if 'request_start' in g:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.record_request(request.method, endpoint, response.status_code,
+                                   time.perf_counter() - g.request_start)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        if 'profiler' in g:
+            g.profiler.stop()
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        # Ready once this worker's processing pool is up
+        if not proxy_server.processing_pool_ready():
+            return jsonify({'ready': False}), 503
+        return jsonify({'ready': True})
+
+    return app
@@ -0,0 +1,99 @@
+import os
+import sys
+from concurrent.futures import as_completed
+
+import pandas as pd
+
+import metrics
+from processing_pool import ProcessingPool, from_columns, to_columns
+
+
+# Process many granules against one centerline and collect a long-format table.
+#
+# Granules are fanned out over a ProcessingPool. Each worker keeps the resampled
+# centerline stations and KD-tree in its station cache, so they are built once per
+# worker rather than once per granule. Per-granule results are yielded as they
+# finish and concatenated into one table indexed by (granule_time, station). With a
+# reach_field, stations are numbered across all reaches and each row carries its reach_id.
+# With a profile reducer, each granule gives its binned water surface profile instead
+# (see binning), and station is the bin.
+
+def granule_time(netcdf_path, result=None):
+    # Start time of the granule, as process_data read it when it opened the granule
+    # (result.attrs), or from the file when the pixels came from the pixel index
+    if result is not None and 'granule_time' in result.attrs:
+        return pd.Timestamp(result.attrs['granule_time'])
+    from remote_granule import open_granule, start_time
+    with open_granule(netcdf_path) as nc:
+        return start_time(nc)
+
+def _process_granule(netcdf_path, granule_name, geojson_path, buffer_distance, spacing, clip_mode, reach_field=None,
+                     profile=None):
+    from external_processor import process_data
+    from processing_pool import MAX_BATCH_ROWS, PIXEL_INDEX_DIR
+    with metrics.Profiler(f'process_data {granule_name}'), metrics.span('process_data', granule=granule_name):
+        result = process_data(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode,
+                              max_batch_rows=MAX_BATCH_ROWS, index_dir=PIXEL_INDEX_DIR, reach_field=reach_field,
+                              profile=profile)
+    result.insert(0, 'station', result['nearest_index'] if profile is None else result.pop('bin'))
+    result.insert(0, 'granule_time', granule_time(netcdf_path, result))
+    result.insert(0, 'granule', granule_name)
+    return to_columns(result)
+
+def process_granule(pool, netcdf_path, granule_name, geojson_path, buffer_distance, spacing, clip_mode='within',
+                    reach_field=None, profile=None):
+    # One granule's rows in a pool worker, waiting for the result
+    return from_columns(pool.run(_process_granule, str(netcdf_path), granule_name, str(geojson_path),
+                                 float(buffer_distance), float(spacing), clip_mode, reach_field, profile).result())
+
+def combine_results(results):
+    # Per-granule results as one table indexed by (granule_time, station); with none,
+    # an empty table with that index and the granule column
+    if not results:
+        index = pd.MultiIndex.from_arrays([pd.DatetimeIndex([], dtype='datetime64[ns]'), pd.Index([], dtype='int64')],
+                                          names=['granule_time', 'station'])
+        return pd.DataFrame({'granule': pd.Series([], dtype=object)}, index=index)
+    return pd.concat(results, ignore_index=True).sort_values(['granule_time', 'station']).set_index(['granule_time', 'station'])
+
+def iter_batch(pool, netcdf_paths, geojson_path, buffer_distance, spacing, clip_mode='within', granule_names=None,
+               reach_field=None, profile=None):
+    # Yield (netcdf_path, result) per granule in completion order; a failed granule
+    # yields its exception instead of a result. Granules are named after their file
+    # unless granule_names is given.
+    if granule_names is None:
+        granule_names = [os.path.splitext(os.path.basename(path))[0] for path in netcdf_paths]
+    futures = {
+        pool.run(_process_granule, str(path), name, str(geojson_path), float(buffer_distance), float(spacing), clip_mode,
+                 reach_field, profile): path
+        for path, name in zip(netcdf_paths, granule_names)
+    }
+    for future in as_completed(futures):
+        try:
+            yield futures[future], from_columns(future.result())
+        except Exception as e:
+            yield futures[future], e
+
+def process_batch(netcdf_paths, geojson_path, buffer_distance, spacing, workers=None, clip_mode='within', pool=None,
+                  granule_names=None, reach_field=None, profile=None):
+    own_pool = pool is None
+    if own_pool:
+        pool = ProcessingPool(workers)
+    try:
+        results = []
+        errors = []
+        for path, result in iter_batch(pool, netcdf_paths, geojson_path, buffer_distance, spacing, clip_mode, granule_names,
+                                       reach_field, profile):
+            if isinstance(result, Exception):
+                print(f"Error processing {path}: {result}", file=sys.stderr)
+                errors.append(result)
+                continue
+            print(f"Processed {path}: {len(result)} rows", file=sys.stderr)
+            results.append(result)
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+    # As for /batch: some granules may fail, but not all of them
+    if errors and not results:
+        raise RuntimeError(f"All {len(errors)} granules failed; first error: {errors[0]}")
+    return combine_results(results)
@@ -0,0 +1,152 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from synthetic_pixc import Swath, centerline_geojson, write_granule
+
+
+# Per-stage wall time, CPU time, rows and peak RSS of process_data on synthetic granules
+# (see synthetic_pixc), written as JSON so runs can be compared between commits.
+#
+# Granules of each --pixels count are generated once into --data-dir and reused. Each
+# granule is processed in a fresh process, so its peak RSS is its own, and the spans
+# process_data records for its stages (see metrics) are collected:
+#
+#   open        open the granule and pick the UTM zone
+#   stations    resample the centerline into stations and build their KD-tree
+#   read        read the pixels in the envelope
+#   clip        project the pixels and clip them to the buffer
+#   match       nearest station of each pixel (KD-tree query)
+#   merge       left-merge the pixels onto the stations
+#
+# or, with --profile REDUCER, in place of the last three:
+#
+#   project     chainage and cross-track offset of each pixel along the line
+#   bin         bin the pixels along track and reduce each bin
+#   serialize   encode the result in --format
+#
+# process_data itself is then timed end to end in another fresh process.
+#
+#   python benchmarks/bench_pipeline.py --pixels 1e5 1e6 1e7 --output before.json
+#   python benchmarks/bench_pipeline.py --pixels 1e5 1e6 1e7 --output after.json
+
+def child_stages(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode, fmt, profile):
+    import metrics
+    from external_processor import process_data
+    from metrics import span
+    from result_formats import encode_result
+
+    stages = {}
+
+    def sink(record):
+        stages[record['span']] = {
+            'seconds': record['seconds'],
+            'cpu_seconds': record['cpu_seconds'],
+            'rows_in': record['rows_in'],
+            'rows_out': record['rows_out'],
+            # ru_maxrss is in kilobytes on Linux; the high-water mark after this stage
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+    metrics.set_span_sink(sink)
+    merged_df = process_data(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode, profile=profile)
+    with span('serialize', rows_in=len(merged_df)):
+        payload = encode_result(merged_df, fmt)[0]
+    stages['serialize']['bytes'] = len(payload)
+    return stages
+
+def child_total(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode, fmt, profile):
+    from external_processor import process_data
+    from result_formats import encode_result
+    wall, cpu = time.perf_counter(), time.process_time()
+    encode_result(process_data(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode, profile=profile), fmt)
+    return {
+        'seconds': time.perf_counter() - wall,
+        'cpu_seconds': time.process_time() - cpu,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def run_child(mode, netcdf_path, geojson_path, args):
+    output = subprocess.run([sys.executable, __file__, '--child', mode, netcdf_path, geojson_path,
+                             '--buffer', str(args.buffer), '--spacing', str(args.spacing),
+                             '--clip-mode', args.clip_mode, '--format', args.format]
+                            + (['--profile', args.profile] if args.profile else []),
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def granule_files(data_dir, pixels, reaches, seed):
+    # Generate the granule and centerline on first use
+    netcdf_path = os.path.join(data_dir, f'pixc_{pixels}_{seed}.nc')
+    geojson_path = os.path.join(data_dir, f'centerline_{reaches}.geojson')
+    swath = Swath()
+    if not os.path.exists(netcdf_path):
+        print(f"Writing {netcdf_path}", file=sys.stderr)
+        write_granule(netcdf_path + '.tmp', pixels, swath, seed)
+        os.replace(netcdf_path + '.tmp', netcdf_path)
+    if not os.path.exists(geojson_path):
+        with open(geojson_path, 'w') as f:
+            json.dump(centerline_geojson(swath, reaches=reaches), f)
+    return netcdf_path, geojson_path
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pixels', type=float, nargs='+', default=[1e5, 1e6])
+    parser.add_argument('--reaches', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--buffer', type=float, default=200)
+    parser.add_argument('--spacing', type=float, default=50)
+    parser.add_argument('--clip-mode', default='within', choices=['within', 'distance'])
+    parser.add_argument('--format', default='json', choices=['json', 'arrow', 'parquet', 'npz'])
+    parser.add_argument('--profile', help='Time the binned profile with this reducer instead of the station table')
+    parser.add_argument('--data-dir', default=os.path.join(REPO, 'bench_data'))
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('paths', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child = child_stages if args.child == 'stages' else child_total
+        print(json.dumps(child(*args.paths, args.buffer, args.spacing, args.clip_mode, args.format, args.profile)))
+        sys.exit()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    runs = []
+    for pixels in map(int, args.pixels):
+        netcdf_path, geojson_path = granule_files(args.data_dir, pixels, args.reaches, args.seed)
+        stages = run_child('stages', netcdf_path, geojson_path, args)
+        total = run_child('total', netcdf_path, geojson_path, args)
+        runs.append({'pixels': pixels, 'stages': stages, 'process_data': total})
+        print(f"{pixels:>10} pixels: process_data {total['seconds']:.2f}s, peak RSS {total['peak_rss_mb']:.0f} MB; "
+              + ', '.join(f"{name} {stage['seconds']:.2f}s" for name, stage in stages.items()), file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'parameters': {'reaches': args.reaches, 'seed': args.seed, 'buffer': args.buffer, 'spacing': args.spacing,
+                       'clip_mode': args.clip_mode, 'format': args.format, 'profile': args.profile},
+        'runs': runs,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
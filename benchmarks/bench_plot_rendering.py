@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+# Render time and RSS growth over many plot requests, for the pyplot rendering the
+# proxy used to do (figures never closed) against plots.render_plot in both modes.
+# Each mode runs in a fresh process so its memory is its own. The result is read from
+# --result (a Parquet file of a process_data result) or made up with --pixels rows.
+#
+#   python benchmarks/bench_plot_rendering.py --pixels 200000 --requests 1000
+
+def rss_mb():
+    # Current resident set size, from /proc on Linux
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+def synthetic_result(pixels):
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    distance = np.sort(rng.uniform(0, 20000, pixels))
+    return pd.DataFrame({
+        'cumulative_distance': distance,
+        'height': 10 + distance * 1e-4 + rng.normal(0, 0.3, pixels),
+        'classification': rng.integers(1, 8, pixels),
+        'geolocation_qual': rng.integers(0, 4, pixels),
+    })
+
+def render_pyplot(df):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from io import BytesIO
+    fig = plt.figure(figsize=(15, 8))
+    ax = fig.add_subplot(111)
+    df_filtered = df[(df['classification'] > 2) & (df['classification'] != 5)]
+    sc = ax.scatter(df_filtered['cumulative_distance'], df_filtered['height'],
+                    c=df_filtered['geolocation_qual'], cmap='viridis', zorder=2, label='SWOT WSE data')
+    ax.legend()
+    fig.colorbar(sc, ax=ax)
+    img = BytesIO()
+    fig.savefig(img, format='png')
+    return img.getvalue()
+
+def child(mode, result_path, pixels, requests):
+    import pandas as pd
+    from plots import render_plot
+    df = pd.read_parquet(result_path) if result_path else synthetic_result(pixels)
+    render = render_pyplot if mode == 'pyplot' else lambda df: render_plot(df, mode)
+
+    render(df)
+    start_rss = rss_mb()
+    times = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        render(df)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print(json.dumps({
+        'mean_ms': 1000 * sum(times) / len(times),
+        'p95_ms': 1000 * times[int(0.95 * (len(times) - 1))],
+        'rss_start_mb': start_rss,
+        'rss_end_mb': rss_mb(),
+    }))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--result', help='Parquet file of a process_data result')
+    parser.add_argument('--pixels', type=int, default=200_000)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--modes', nargs='+', default=['pyplot', 'scatter', 'density'])
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.result, args.pixels, args.requests)
+        sys.exit(0)
+
+    print(f"{'mode':>10} {'requests':>9} {'mean ms':>9} {'p95 ms':>9} {'RSS start MB':>13} {'RSS end MB':>11}")
+    for mode in args.modes:
+        command = [sys.executable, __file__, '--child', mode, '--pixels', str(args.pixels), '--requests', str(args.requests)]
+        if args.result:
+            command += ['--result', args.result]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>10} {args.requests:>9} {result['mean_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['rss_start_mb']:>13.1f} {result['rss_end_mb']:>11.1f}")
@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS
+from shapely.geometry import LineString
+
+from projection import extent_epsg, get_transformer, project_geometries, to_utm
+
+
+# Zone selection and the reprojection steps of clipping, done the old way (CRS.from_dict
+# per call; centerline to_crs to UTM, buffer to_crs back to lon/lat, sjoin on Point
+# geometries, clipped pixels to_crs to UTM) against the projection module (arithmetic
+# EPSG codes, cached Transformers, raw lon/lat arrays, clipping in UTM).
+#
+#   python benchmarks/bench_projection.py --pixels 100000 1000000 --repeat 3
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def old_epsg(min_lat, max_lat, min_lon, max_lon):
+    zone = int(((min_lon + max_lon) / 2 + 180) / 6) + 1
+    return CRS.from_dict({'proj': 'utm', 'zone': zone, 'south': (min_lat + max_lat) / 2 < 0}).to_epsg()
+
+def old_clip(line, lon, lat, epsg_code, buffer_distance):
+    river = line.to_crs(epsg_code)
+    buffered = gpd.GeoDataFrame(geometry=river.buffer(buffer_distance, cap_style='flat'), crs=river.crs).to_crs('EPSG:4326')
+    pixels = gpd.GeoDataFrame(pd.DataFrame({'longitude': lon, 'latitude': lat}),
+                              geometry=gpd.points_from_xy(lon, lat), crs='EPSG:4326')
+    clipped = gpd.sjoin(pixels, buffered, how='inner', predicate='within').to_crs(epsg_code)
+    return np.column_stack((clipped.geometry.x, clipped.geometry.y))
+
+def new_clip(line, lon, lat, epsg_code, buffer_distance):
+    river = project_geometries(line.geometry.values, 'EPSG:4326', epsg_code)
+    x, y = to_utm(lon, lat, epsg_code)
+    inside = np.zeros(len(x), dtype=bool)
+    for polygon in shapely.buffer(river, buffer_distance, cap_style='flat'):
+        inside |= shapely.contains_xy(polygon, x, y)
+    return np.column_stack((x[inside], y[inside]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pixels', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--buffer', type=float, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    extent = (51.40, 51.60, -0.25, 0.05)
+    print(f"zone selection: CRS.from_dict {1e6 * timed(lambda: old_epsg(*extent), 200):.1f} us, "
+          f"arithmetic {1e6 * timed(lambda: extent_epsg(*extent), 200):.1f} us")
+    epsg_code = extent_epsg(*extent)
+    get_transformer('EPSG:4326', epsg_code)
+
+    line = gpd.GeoDataFrame(geometry=[LineString([(-0.137, 51.484), (-0.11, 51.49), (-0.09, 51.50), (-0.05, 51.507)])],
+                            crs='EPSG:4326')
+    rng = np.random.default_rng(0)
+    print(f"{'pixels':>10} {'to_crs chain s':>15} {'projection s':>13} {'speed-up':>9}")
+    for pixels in args.pixels:
+        lat = rng.uniform(extent[0], extent[1], pixels)
+        lon = rng.uniform(extent[2], extent[3], pixels)
+        old_seconds = timed(lambda: old_clip(line, lon, lat, epsg_code, args.buffer), args.repeat)
+        new_seconds = timed(lambda: new_clip(line, lon, lat, epsg_code, args.buffer), args.repeat)
+        print(f"{pixels:>10} {old_seconds:>15.3f} {new_seconds:>13.3f} {old_seconds / new_seconds:>8.1f}x")
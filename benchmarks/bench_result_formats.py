@@ -0,0 +1,42 @@
+import argparse
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from external_processor import process_data
+from result_formats import FORMATS, decode_result, encode_result
+
+
+# Payload size and encode/decode time of each result format for one reference granule.
+#
+#   python benchmarks/bench_result_formats.py granule.nc line.geojson --buffer 50 --spacing 5
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return value, best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('netcdf_path')
+    parser.add_argument('geojson_path')
+    parser.add_argument('--buffer', type=float, default=50)
+    parser.add_argument('--spacing', type=float, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    result = process_data(args.netcdf_path, args.geojson_path, args.buffer, args.spacing)
+    print(f"{len(result)} rows x {len(result.columns)} columns, {result.memory_usage(deep=True).sum() / 1e6:.1f} MB in memory")
+    print(f"{'format':>8} {'bytes':>12} {'encode ms':>10} {'decode ms':>10} {'round trip ms':>14}")
+    for fmt in FORMATS:
+        (payload, _), encode_seconds = timed(lambda: encode_result(result, fmt), args.repeat)
+        _, decode_seconds = timed(lambda: decode_result(payload, fmt), args.repeat)
+        print(f"{fmt:>8} {len(payload):>12} {encode_seconds * 1000:>10.1f} {decode_seconds * 1000:>10.1f} "
+              f"{(encode_seconds + decode_seconds) * 1000:>14.1f}")
@@ -0,0 +1,130 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from bench_pipeline import git_commit, granule_files
+
+
+# Cold start and first-job latency of external_processor.py, written as JSON so runs can
+# be compared between commits:
+#
+#   interpreter   python -c pass, the floor under everything else
+#   import        python -c 'import external_processor', and the same for proxy_server
+#                 (what every gunicorn worker and spawned pool worker pays)
+#   cli           one reach through a fresh external_processor.py, start to result
+#   serve_first   external_processor.py --serve started and sent a job, start to answer
+#   serve_next    later jobs sent to the same --serve process, one at a time
+#
+# Each cold measurement runs --repeat fresh processes; the modules each one imports are
+# listed so a regression can be traced to the import that brought it in.
+#
+#   python benchmarks/bench_startup.py --pixels 1e5 --output before.json
+
+def cold(code, repeat):
+    # Wall times of fresh interpreters running code
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=REPO, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def loaded_modules(module):
+    # The heavy third-party packages importing module pulls in
+    code = (f'import sys; import {module}; '
+            f'print(" ".join(sorted({{name.split(".")[0] for name in sys.modules}})))')
+    names = subprocess.run([sys.executable, '-c', code], cwd=REPO, check=True, capture_output=True,
+                           text=True).stdout.split()
+    return [name for name in names if name in ('geopandas', 'pandas', 'scipy', 'shapely', 'pyproj', 'netCDF4', 'h5py',
+                                               'xarray', 'matplotlib', 'pyarrow')]
+
+def cli(job, repeat):
+    times = []
+    command = [sys.executable, os.path.join(REPO, 'external_processor.py'), job['netcdf_path'], job['geojson_path'],
+               str(job['buffer_distance']), str(job['spacing'])]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+def serve(job, repeat, jobs):
+    # (start to first answer of each fresh --serve process, latencies of the jobs after it)
+    first, later = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO, 'external_processor.py'), '--serve'],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for i in range(jobs):
+            sent = time.perf_counter()
+            process.stdin.write(json.dumps({'id': i, **job}) + '\n')
+            process.stdin.flush()
+            response = json.loads(process.stdout.readline())
+            if 'error' in response:
+                raise RuntimeError(response['error'])
+            if i == 0:
+                first.append(time.perf_counter() - start)
+            else:
+                later.append(time.perf_counter() - sent)
+        process.stdin.close()
+        process.wait()
+    return first, later
+
+def stats(times):
+    times = sorted(times)
+    return {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1]} if times else None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pixels', type=float, default=1e5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--buffer', type=float, default=200)
+    parser.add_argument('--spacing', type=float, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=5, help='Jobs sent to each --serve process')
+    parser.add_argument('--data-dir', default=os.path.join(REPO, 'bench_data'))
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    netcdf_path, geojson_path = granule_files(args.data_dir, int(args.pixels), 1, args.seed)
+    job = {'netcdf_path': netcdf_path, 'geojson_path': geojson_path, 'buffer_distance': args.buffer,
+           'spacing': args.spacing}
+
+    serve_first, serve_next = serve(job, args.repeat, args.jobs)
+    results = {
+        'interpreter': stats(cold('pass', args.repeat)),
+        'import': {module: {**stats(cold(f'import {module}', args.repeat)), 'modules': loaded_modules(module)}
+                   for module in ('external_processor', 'proxy_server')},
+        'cli': stats(cli(job, args.repeat)),
+        'serve_first': stats(serve_first),
+        'serve_next': stats(serve_next),
+    }
+    print(f"interpreter {results['interpreter']['median']:.3f}s, "
+          + ', '.join(f"import {module} {result['median']:.3f}s" for module, result in results['import'].items())
+          + f", cli {results['cli']['median']:.3f}s, serve first {results['serve_first']['median']:.3f}s"
+          + (f", next {results['serve_next']['median']:.3f}s" if serve_next else ''), file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'parameters': {'pixels': int(args.pixels), 'seed': args.seed, 'buffer': args.buffer, 'spacing': args.spacing,
+                       'repeat': args.repeat, 'jobs': args.jobs},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+# Peak RSS and wall time of process_data reading granules whole (eager) against
+# streaming them in batches of --max-batch-rows pixels. Each run is a fresh process
+# so its peak RSS is its own.
+#
+#   python benchmarks/bench_streaming.py line.geojson small.nc medium.nc large.nc --max-batch-rows 1000000
+
+def child(netcdf_path, geojson_path, buffer_distance, spacing, max_batch_rows):
+    from external_processor import process_data
+    start = time.perf_counter()
+    process_data(netcdf_path, geojson_path, buffer_distance, spacing, max_batch_rows=max_batch_rows or None)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+def pixel_count(netcdf_path):
+    from netCDF4 import Dataset
+    with Dataset(netcdf_path, 'r') as nc:
+        return nc.groups['pixel_cloud'].variables['latitude'].shape[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('geojson_path')
+    parser.add_argument('netcdf_paths', nargs='+')
+    parser.add_argument('--buffer', type=float, default=50)
+    parser.add_argument('--spacing', type=float, default=5)
+    parser.add_argument('--max-batch-rows', type=int, default=1_000_000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.netcdf_paths[0], args.geojson_path, args.buffer, args.spacing, args.max_batch_rows)
+        sys.exit(0)
+
+    print(f"{'granule':>40} {'pixels':>12} {'mode':>10} {'seconds':>9} {'peak RSS MB':>12}")
+    for netcdf_path in args.netcdf_paths:
+        for mode, max_batch_rows in (('eager', 0), ('streaming', args.max_batch_rows)):
+            output = subprocess.run(
+                [sys.executable, __file__, args.geojson_path, netcdf_path, '--child',
+                 '--buffer', str(args.buffer), '--spacing', str(args.spacing), '--max-batch-rows', str(max_batch_rows)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{os.path.basename(netcdf_path):>40} {pixel_count(netcdf_path):>12} {mode:>10} "
+                  f"{result['seconds']:>9.2f} {result['peak_rss_mb']:>12.1f}")
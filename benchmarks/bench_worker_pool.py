@@ -0,0 +1,55 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from io import StringIO
+
+import pandas as pd
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from processing_pool import ProcessingPool
+
+
+# Per-request latency of process_data through a fresh external_processor.py
+# subprocess with JSON on stdout, against a warm ProcessingPool.
+#
+#   python benchmarks/bench_worker_pool.py granule.nc line.geojson --buffer 50 --spacing 5
+
+def run_subprocess(netcdf_path, geojson_path, buffer_distance, spacing):
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'external_processor.py'), netcdf_path, geojson_path, str(buffer_distance), str(spacing)],
+        capture_output=True, text=True, check=True
+    )
+    return pd.read_json(StringIO(result.stdout))
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+def summary(name, times):
+    times = sorted(times)
+    print(f"{name:>12}: min {times[0] * 1000:8.1f} ms  median {times[len(times) // 2] * 1000:8.1f} ms  max {times[-1] * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('netcdf_path')
+    parser.add_argument('geojson_path')
+    parser.add_argument('--buffer', type=float, default=50)
+    parser.add_argument('--spacing', type=float, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    summary('subprocess', timed(lambda: run_subprocess(args.netcdf_path, args.geojson_path, args.buffer, args.spacing), args.repeat))
+
+    pool = ProcessingPool(args.workers)
+    pool.warm()
+    summary('warm pool', timed(lambda: pool.process(args.netcdf_path, args.geojson_path, args.buffer, args.spacing), args.repeat))
+    pool.shutdown()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import pandas as pd
+
+import metrics
+import remote_granule
+from bench_pipeline import granule_files
+from external_processor import process_data
+
+
+# process_data on a granule read over HTTP range requests (remote_granule) against the
+# same granule read from the local file. A synthetic granule is served from a local
+# ThreadingHTTPServer that answers Range requests with 206, as the PO.DAAC and S3 links
+# do; the tables must be equal, and the share of the file fetched and the number of
+# requests are printed from the 'remote_granule' span, next to what the server sent.
+# Both the eager read and the batched one (--max-batch-rows) are checked. Any
+# difference exits with status 1. The centerline covers the first --line-fraction of
+# the synthetic river, so only part of the granule's chunks hold pixels near it.
+#
+#   python benchmarks/check_remote_granule.py --pixels 1e6 --line-fraction 0.2
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Serves the files of server.directory, whole or by a single 'bytes=a-b' range
+    def do_HEAD(self):
+        self.send_file(head=True)
+
+    def do_GET(self):
+        self.send_file(head=False)
+
+    def send_file(self, head):
+        path = os.path.join(self.server.directory, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, stop = 0, size
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            stop = min(size, int(match.group(2)) + 1) if match.group(2) else size
+        self.send_response(206 if match else 200)
+        if match:
+            self.send_header('Content-Range', f'bytes {start}-{stop - 1}/{size}')
+        self.send_header('Content-Length', str(stop - start if match or not head else size))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if head:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(stop - start)
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_sent += len(data)
+
+    def log_message(self, *args):
+        pass
+
+def partial_centerline(geojson_path, fraction):
+    # The first fraction of the centerline's vertices, written next to it
+    with open(geojson_path) as f:
+        geojson = json.load(f)
+    for feature in geojson['features']:
+        coordinates = feature['geometry']['coordinates']
+        feature['geometry']['coordinates'] = coordinates[:max(2, int(len(coordinates) * fraction))]
+    path = geojson_path.replace('.geojson', f'_{fraction}.geojson')
+    with open(path, 'w') as f:
+        json.dump(geojson, f)
+    return path
+
+def serve(directory):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.directory = directory
+    server.lock = threading.Lock()
+    server.requests = server.bytes_sent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pixels', type=float, default=2e5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--buffer', type=float, default=200)
+    parser.add_argument('--spacing', type=float, default=50)
+    parser.add_argument('--max-batch-rows', type=int, default=50_000)
+    parser.add_argument('--line-fraction', type=float, default=0.2, help='Share of the river the centerline covers')
+    parser.add_argument('--data-dir', default=os.path.join(REPO, 'bench_data'))
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    netcdf_path, geojson_path = granule_files(args.data_dir, int(args.pixels), 1, args.seed)
+    geojson_path = partial_centerline(geojson_path, args.line_fraction)
+    server = serve(os.path.dirname(netcdf_path))
+    url = f'http://127.0.0.1:{server.server_address[1]}/{os.path.basename(netcdf_path)}'
+
+    # The fetch stats come back on the span RemoteDataset.close records
+    spans = []
+    metrics.set_span_sink(lambda record: spans.append(record) if record['span'] == 'remote_granule' else None)
+
+    failed = False
+    for name, max_batch_rows in (('eager', None), ('batched', args.max_batch_rows)):
+        local = process_data(netcdf_path, geojson_path, args.buffer, args.spacing, max_batch_rows=max_batch_rows)
+        # An empty block cache, so the remote read fetches everything it needs
+        remote_granule.block_cache.clear()
+        server.requests = server.bytes_sent = 0
+        del spans[:]
+        remote = process_data(url, geojson_path, args.buffer, args.spacing, max_batch_rows=max_batch_rows)
+
+        try:
+            pd.testing.assert_frame_equal(remote, local)
+            same = 'equal'
+        except AssertionError as e:
+            same = f'DIFFERENT: {e}'
+            failed = True
+        stats = spans[-1]
+        print(f"{name:>8}: {len(remote)} rows, {same}; fetched {stats['bytes_transferred']} of {stats['file_size']} "
+              f"bytes ({100 * stats['fetched_ratio']:.1f}%) in {stats['requests']} range requests "
+              f"(server sent {server.bytes_sent} bytes in {server.requests})")
+
+    server.shutdown()
+    print('FAILED' if failed else 'OK')
+    sys.exit(1 if failed else 0)
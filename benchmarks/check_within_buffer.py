@@ -0,0 +1,118 @@
+import argparse
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, MultiLineString
+
+from centerline import line_parts, within_buffer
+
+
+# centerline.within_buffer against the polygon test it replaced, shapely.buffer(line,
+# buffer, quad_segs=16, cap_style='flat') then contains_xy, on random points around
+# fixed lines (straight, bent, a MultiLineString with a gap, the flat end caps) and
+# random lines. Each disagreement is put down to one of:
+#
+#   chord   the point is within a chord's sagitta of the buffer distance: GEOS draws the
+#           round joins with quad_segs chords per quarter circle, within_buffer with arcs
+#   fold    within_buffer keeps the point, GEOS drops it, and the line turns by more than
+#           90 degrees or starts or ends with a segment shorter than the buffer distance.
+#           There the GEOS offset curve can fold over itself (a single hairpin is fine,
+#           a short end segment or a line doubling back several times is not) and the
+#           buffer loses area that lies within the distance of a segment, anywhere from
+#           about 0.05 to 0.95 of the buffer distance from the line; within_buffer keeps
+#           the exact union of the segment rectangles and join wedges
+#
+# Anything else is a failure and the script exits with status 1.
+#
+#   python benchmarks/check_within_buffer.py --lines 1000
+
+QUAD_SEGS = 16
+
+def folds(geometry, buffer_distance):
+    # Whether the GEOS buffer outline of some part of geometry folds over itself
+    for part in line_parts(geometry):
+        direction = np.diff(part, axis=0)
+        length = np.hypot(*direction.T)
+        direction, length = direction[length > 0], length[length > 0]
+        if not len(length):
+            continue
+        turn = np.einsum('ij,ij->i', direction[:-1], direction[1:]) / (length[:-1] * length[1:])
+        if (turn < 0).any() or length[0] < buffer_distance or length[-1] < buffer_distance:
+            return True
+    return False
+
+def compare(geometry, x, y, buffer_distance):
+    # Counts of the points kept and of the disagreements by cause
+    ours = within_buffer(x, y, np.array([geometry]), buffer_distance)
+    polygon = shapely.buffer(geometry, buffer_distance, quad_segs=QUAD_SEGS, cap_style='flat')
+    reference = shapely.contains_xy(polygon, x, y)
+    distance = shapely.distance(shapely.points(x, y), geometry)
+
+    differ = ours != reference
+    chord = differ & (distance >= buffer_distance * np.cos(np.pi / (4 * QUAD_SEGS)))
+    fold = differ & ~chord & ours & folds(geometry, buffer_distance)
+    return {'points': len(x), 'kept': int(ours.sum()), 'differ': int(differ.sum()), 'chord': int(chord.sum()),
+            'fold': int(fold.sum()), 'unexplained': int((differ & ~chord & ~fold).sum())}
+
+def around(geometry, margin, pixels, rng):
+    x0, y0, x1, y1 = geometry.bounds
+    return rng.uniform(x0 - margin, x1 + margin, pixels), rng.uniform(y0 - margin, y1 + margin, pixels)
+
+def around_ends(length, margin, pixels, rng):
+    # Points within margin of either end of the line (0, 0)-(length, 0)
+    x = rng.uniform(-margin, margin, pixels) + np.where(rng.random(pixels) < 0.5, 0, length)
+    return x, rng.uniform(-margin, margin, pixels)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buffer', type=float, default=100)
+    parser.add_argument('--pixels', type=int, default=100_000, help='Random points per fixed line')
+    parser.add_argument('--lines', type=int, default=500, help='Random lines to compare')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    r = args.buffer
+    rng = np.random.default_rng(args.seed)
+    straight = LineString([(0, 0), (10 * r, 0)])
+    cases = [
+        ('straight', straight, around(straight, 1.5 * r, args.pixels, rng)),
+        ('diagonal', LineString([(0, 0), (7 * r, 7 * r)]), None),
+        ('bends', LineString([(0, 0), (5 * r, 3 * r), (9 * r, r), (15 * r, 6 * r)]), None),
+        ('gap', MultiLineString([[(0, 0), (5 * r, 0)], [(7 * r, 0), (12 * r, 0)]]), None),
+        ('end caps', straight, around_ends(10 * r, 1.5 * r, args.pixels, rng)),
+        ('hairpin', LineString([(0, 0), (10 * r, 0), (2 * r, 0.6 * r)]), None),
+        ('short end', LineString([(0, 0), (6 * r, 0), (6.3 * r, 0.3 * r)]), None),
+        ('switchback', LineString(np.array([(6.42, 7.79), (0.39, 8.33), (4.99, 8.02), (0.24, 7.6), (5.74, 9.15),
+                                            (1.05, 8.96)]) * r), None),
+    ]
+
+    failed = False
+    print(f"{'case':>12} {'points':>8} {'kept':>8} {'differ':>7} {'chord':>6} {'fold':>6} {'unexplained':>12}")
+    for name, geometry, points in cases:
+        x, y = points if points is not None else around(geometry, 1.5 * r, args.pixels, rng)
+        counts = compare(geometry, x, y, r)
+        failed |= counts['unexplained'] > 0
+        print(f"{name:>12} " + ' '.join(f"{counts[k]:>{w}}" for k, w in
+                                         (('points', 8), ('kept', 8), ('differ', 7), ('chord', 6), ('fold', 6),
+                                          ('unexplained', 12))))
+
+    # Random lines of 2 to 8 vertices in a 10 x 10 buffer distance square
+    totals = dict.fromkeys(('differ', 'chord', 'fold', 'unexplained'), 0)
+    folded = 0
+    for _ in range(args.lines):
+        line = LineString(rng.uniform(0, 10 * r, (rng.integers(2, 9), 2)))
+        counts = compare(line, *around(line, 1.5 * r, 10_000, rng), r)
+        for name in totals:
+            totals[name] += counts[name]
+        folded += counts['fold'] > 0
+    failed |= totals['unexplained'] > 0
+    print(f"{args.lines} random lines: {totals['differ']} points differ, {totals['chord']} chord, "
+          f"{totals['fold']} fold (on {folded} lines), {totals['unexplained']} unexplained")
+
+    print('FAILED' if failed else 'OK')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Requests per second of POST /query against the number of server threads.
+#
+# CMR is replaced by a local stub answering after --cmr-latency seconds, and every
+# request asks for a different bounding box so the CMR client's cache never answers.
+# For each thread count the launcher (server.py) is started on a free port, the test
+# waits for /ready and then sends --requests requests from --concurrency client threads.
+#
+#   python benchmarks/load_test.py --threads 4 8 16 --requests 2000 --concurrency 32
+
+class CMRStub(BaseHTTPRequestHandler):
+    latency = 0.05
+    entries = 20
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        time.sleep(self.latency)
+        entries = [{
+            'id': f'G{i}-POCLOUD',
+            'title': f'SWOT_L2_HR_PIXC_{i:03d}',
+            'time_start': '2024-01-01T00:00:00.000Z',
+            'time_end': '2024-01-01T00:01:00.000Z',
+            'links': [{'href': f'https://example.com/SWOT_L2_HR_PIXC_{i:03d}.nc',
+                       'rel': 'http://esipfed.org/ns/fedsearch/1.1/data#'}],
+        } for i in range(self.entries)]
+        body = json.dumps({'feed': {'entry': entries}, 'bounding_box': query.get('bounding_box')}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('CMR-Hits', str(self.entries))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_ready(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{url}/ready', timeout=1).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} did not become ready")
+
+def run_load(url, total, concurrency):
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    failures = []
+
+    def query(i):
+        body = {'min_lat': 51 + i * 1e-6, 'max_lat': 52, 'min_lng': -1, 'max_lng': 0,
+                'start_date': '2024-01-01T00:00:00Z', 'end_date': '2024-01-02T00:00:00Z'}
+        response = session.post(f'{url}/query', json=body, timeout=60)
+        if response.status_code != 200:
+            failures.append(response.status_code)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(query, range(total)))
+    return total / (time.perf_counter() - start), len(failures)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--cmr-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    CMRStub.latency = args.cmr_latency
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), CMRStub)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    env = dict(os.environ, CMR_URL=f'http://127.0.0.1:{stub.server_port}/search/granules.json', PROCESSING_WORKERS='1')
+    print(f"{'threads':>8} {'requests':>9} {'failed':>7} {'req/s':>9}")
+    for threads in args.threads:
+        port = free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(REPO, 'server.py'), '--threads', str(threads),
+                                   '--bind', f'127.0.0.1:{port}'],
+                                  cwd=REPO, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f'http://127.0.0.1:{port}'
+            wait_ready(url)
+            rate, failed = run_load(url, args.requests, args.concurrency)
+            print(f"{threads:>8} {args.requests:>9} {failed:>7} {rate:>9.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+    stub.shutdown()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import math
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+# Synthetic SWOT PIXC granules and centerlines for offline benchmarks.
+#
+# A granule is a swath of along-track lines of pixels, written to a pixel_cloud group
+# laid out like the real product: one 'points' dimension, the PIXC_VARIABLES with
+# their on-disk types, fill values and attributes, zlib-compressed chunks, and the
+# granule start/end times as global attributes. A meandering river runs down the
+# middle of the swath; pixels within RIVER_WIDTH/2 of it are classified as open water
+# and carry a water surface sloping downstream, the rest are land. Pixels are written
+# a block of lines at a time, so 5e7-pixel granules need no more memory than 1e6.
+#
+#   python benchmarks/synthetic_pixc.py granule.nc line.geojson --pixels 10000000 --reaches 4
+
+EARTH_METRES_PER_DEGREE = 111_320.0
+RIVER_WIDTH = 150.0
+CHUNK_ROWS = 65_536
+WRITE_ROWS = 1_000_000
+
+# (dtype, _FillValue, attributes) of each pixel_cloud variable
+VARIABLES = {
+    'latitude': ('f8', 9.969209968386869e36, {'long_name': 'latitude (positive N, negative S)', 'units': 'degrees_north',
+                                              'valid_min': -80.0, 'valid_max': 80.0}),
+    'longitude': ('f8', 9.969209968386869e36, {'long_name': 'longitude (degrees East)', 'units': 'degrees_east',
+                                               'valid_min': -180.0, 'valid_max': 180.0}),
+    'height': ('f4', 9.96921e36, {'long_name': 'height above reference ellipsoid', 'units': 'm',
+                                  'valid_min': -1500.0, 'valid_max': 15000.0}),
+    'water_frac': ('f4', 9.96921e36, {'long_name': 'water fraction', 'units': '1',
+                                      'valid_min': -1000.0, 'valid_max': 10000.0}),
+    'coherent_power': ('f4', 9.96921e36, {'long_name': 'power of the coherent sum of looks', 'units': '1',
+                                          'valid_min': 0.0, 'valid_max': 1e16}),
+    'classification': ('u1', 255, {'long_name': 'flags indicating water detection results',
+                                   'flag_meanings': 'land land_near_water water_near_land open_water dark_water '
+                                                    'low_coh_water_near_land open_low_coh_water',
+                                   'flag_values': np.arange(1, 8, dtype='u1'), 'valid_min': 1, 'valid_max': 7}),
+    'missed_detection_rate': ('f4', 9.96921e36, {'long_name': 'probability of missed detection', 'units': '1',
+                                                 'valid_min': 0.0, 'valid_max': 1.0}),
+    'geolocation_qual': ('u4', 4294967295, {'long_name': 'summary quality indicator on geolocation', 'units': '1',
+                                            'valid_min': 0, 'valid_max': 4294967294}),
+}
+
+class Swath:
+    # Geometry shared by a granule and its centerline: a swath of length_m along track
+    # (northwards) and width_m across, centred on (lat0, lon0), with a river meandering
+    # down its middle
+    def __init__(self, lat0=51.5, lon0=-0.1, length_m=64_000.0, width_m=64_000.0,
+                 amplitude_m=2_000.0, wavelength_m=12_000.0):
+        self.lat0, self.lon0 = lat0, lon0
+        self.length_m, self.width_m = length_m, width_m
+        self.amplitude_m, self.wavelength_m = amplitude_m, wavelength_m
+
+    def river_x(self, y):
+        # Across-track position of the river at along-track distance y
+        return self.amplitude_m * np.sin(2 * np.pi * y / self.wavelength_m)
+
+    def to_lonlat(self, x, y):
+        # Local metres to lon/lat, equirectangular about the swath centre
+        lat = self.lat0 + (y - self.length_m / 2) / EARTH_METRES_PER_DEGREE
+        lon = self.lon0 + x / (EARTH_METRES_PER_DEGREE * math.cos(math.radians(self.lat0)))
+        return lon, lat
+
+def centerline_geojson(swath, vertices=2000, reaches=1, margin_m=2_000.0):
+    # The river as a FeatureCollection, split into `reaches` consecutive features with
+    # reach_id properties, running from one end of the swath to the other
+    y = np.linspace(margin_m, swath.length_m - margin_m, vertices)
+    lon, lat = swath.to_lonlat(swath.river_x(y), y)
+    coordinates = np.column_stack((lon, lat)).tolist()
+    bounds = np.linspace(0, vertices - 1, reaches + 1).round().astype(int)
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'reach_id': f'reach_{i:03d}'},
+         'geometry': {'type': 'LineString', 'coordinates': coordinates[start:stop + 1]}}
+        for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]}
+
+def write_granule(path, pixels, swath=None, seed=0, chunk_rows=CHUNK_ROWS, time_start='2024-01-01T00:00:00.000000Z'):
+    swath = swath or Swath()
+    rng = np.random.default_rng(seed)
+    lines = max(1, int(math.sqrt(pixels * swath.length_m / swath.width_m)))
+    line_pixels = math.ceil(pixels / lines)
+    spacing_y = swath.length_m / lines
+    spacing_x = swath.width_m / line_pixels
+
+    with Dataset(path, 'w') as nc:
+        nc.time_granule_start = time_start
+        nc.time_granule_end = time_start
+        nc.title = 'Synthetic Level 2 KaRIn High Rate Water Mask Pixel Cloud Data Product'
+        pixel_cloud = nc.createGroup('pixel_cloud')
+        pixel_cloud.description = 'cloud of geolocated interferogram pixels'
+        pixel_cloud.createDimension('points', pixels)
+        variables = {}
+        for name, (dtype, fill, attributes) in VARIABLES.items():
+            variable = pixel_cloud.createVariable(name, dtype, ('points',), fill_value=fill, zlib=True, complevel=4,
+                                                  shuffle=True, chunksizes=(min(pixels, chunk_rows),))
+            # Valid ranges have the variable's own type, as netCDF4 expects when masking
+            variable.setncatts({key: np.array(value, dtype) if key in ('valid_min', 'valid_max') else value
+                                for key, value in attributes.items()})
+            variables[name] = variable
+
+        for start in range(0, pixels, WRITE_ROWS):
+            stop = min(pixels, start + WRITE_ROWS)
+            row = np.arange(start, stop)
+            y = (row // line_pixels + 0.5) * spacing_y + rng.normal(0, spacing_y / 4, len(row))
+            x = (row % line_pixels + 0.5) * spacing_x - swath.width_m / 2 + rng.normal(0, spacing_x / 4, len(row))
+            lon, lat = swath.to_lonlat(x, y)
+
+            water = np.abs(x - swath.river_x(y)) < RIVER_WIDTH / 2
+            height = np.where(water, 30.0 - 2e-4 * y, 35.0 + 20.0 * rng.random(len(row))) + rng.normal(0, 0.2, len(row))
+            # A few pixels have no height, as layover and dark water leave in real granules
+            height[rng.random(len(row)) < 0.01] = np.nan
+
+            variables['latitude'][start:stop] = lat
+            variables['longitude'][start:stop] = lon
+            variables['height'][start:stop] = np.ma.masked_invalid(height)
+            variables['water_frac'][start:stop] = np.where(water, rng.uniform(0.6, 1.2, len(row)),
+                                                           rng.uniform(-0.2, 0.3, len(row)))
+            variables['coherent_power'][start:stop] = rng.gamma(2.0, np.where(water, 400.0, 40.0))
+            variables['classification'][start:stop] = np.where(water, 4, rng.choice([1, 2, 3], len(row), p=[.9, .05, .05]))
+            variables['missed_detection_rate'][start:stop] = rng.random(len(row)) * np.where(water, 0.1, 1.0)
+            variables['geolocation_qual'][start:stop] = rng.choice([0, 1, 2, 4], len(row), p=[.85, .1, .04, .01])
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('netcdf_path')
+    parser.add_argument('geojson_path')
+    parser.add_argument('--pixels', type=float, default=1e6, help='Pixel count, e.g. 1e5 to 5e7')
+    parser.add_argument('--reaches', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    swath = Swath()
+    write_granule(args.netcdf_path, int(args.pixels), swath, args.seed)
+    with open(args.geojson_path, 'w') as f:
+        json.dump(centerline_geojson(swath, reaches=args.reaches), f)
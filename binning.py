@@ -0,0 +1,180 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from centerline import line_parts
+
+
+# Along-track binning of pixels into a longitudinal profile.
+#
+# Each pixel is projected onto its nearest centerline segment, giving a continuous
+# chainage (distance along the line, parts and features walked in order with the gaps
+# between them not counted, as resample_line does for the parts of one feature) and a
+# signed cross-track offset (positive to the left, looking downstream). Pixels whose foot
+# falls beyond a loose end are dropped rather than piled onto the end station: the start
+# and end of the line, and the ends of parts (or features) that do not join the next one,
+# so pixels in the gap between two parts are not all given the chainage at its edges. Chainage is then cut into bins of width `spacing` starting at 0, so on
+# a single feature bin k runs from station k to station k + 1 of resample_centerline,
+# the last one stopping at the end of the line.
+#
+# A reducer turns the values of each bin into one number. Reducers are given the values
+# sorted by bin and then by value, so order statistics cost no further sort:
+#
+#   reducer(values, weights, bins, start, count) -> array of len(count), NaN where empty
+#
+# where bins is each value's bin, start and count each bin's first position and size.
+# New reducers are added to REDUCERS.
+
+# Share of each end of a bin's sorted values dropped by 'trimmed_mean'
+TRIM_FRACTION = 0.1
+# 'mad' drops values further than this many robust standard deviations from the bin median
+MAD_THRESHOLD = 3.0
+# Scales the median absolute deviation to a standard deviation for normal data
+MAD_SCALE = 1.4826
+
+def line_segments(geometries):
+    # Start and end points of every non-degenerate segment of the projected geometries,
+    # with the chainage at each start, whether the segment starts or ends at a loose end
+    # (the end of a part that does not meet the part before or after it), and the length
+    # of the line
+    parts, offset = [], 0.0
+    for geometry in geometries:
+        for part in line_parts(geometry):
+            length = np.hypot(*np.diff(part, axis=0).T)
+            along = offset + np.concatenate([[0.0], np.cumsum(length)[:-1]])
+            offset += length.sum()
+            nonzero = length > 0
+            if nonzero.any():
+                parts.append((part[:-1][nonzero], part[1:][nonzero], along[nonzero]))
+
+    starts, ends, chainage, open_start, open_end = [], [], [], [], []
+    for i, (start, end, along) in enumerate(parts):
+        loose_start = np.zeros(len(start), dtype=bool)
+        loose_end = np.zeros(len(start), dtype=bool)
+        loose_start[0] = i == 0 or not np.array_equal(parts[i - 1][1][-1], start[0])
+        loose_end[-1] = i == len(parts) - 1 or not np.array_equal(end[-1], parts[i + 1][0][0])
+        starts.append(start)
+        ends.append(end)
+        chainage.append(along)
+        open_start.append(loose_start)
+        open_end.append(loose_end)
+    if not parts:
+        empty = np.empty((0, 2))
+        return empty, empty, np.empty(0), np.empty(0, dtype=bool), np.empty(0, dtype=bool), offset
+    return (np.concatenate(starts), np.concatenate(ends), np.concatenate(chainage), np.concatenate(open_start),
+            np.concatenate(open_end), offset)
+
+def project_to_line(x, y, geometries, max_offset):
+    # (chainage, offset) of each point (projected x, y) from its nearest segment, NaN for
+    # points further than max_offset from the line or beyond a loose end of it. Candidate
+    # (point, segment) pairs come from a KD-tree over the points, as in within_buffer, so
+    # each segment is only tested against the points near it.
+    chainage = np.full(len(x), np.nan)
+    offset = np.full(len(x), np.nan)
+    start, end, start_chainage, open_start, open_end, _ = line_segments(geometries)
+    if not len(x) or not len(start):
+        return chainage, offset
+
+    dx, dy = (end - start).T
+    length = np.hypot(dx, dy)
+    candidates = cKDTree(np.column_stack((x, y))).query_ball_point((start + end) / 2, length / 2 + max_offset,
+                                                                   return_sorted=False)
+    counts = np.array([len(c) for c in candidates])
+    if not counts.sum():
+        return chainage, offset
+    segment = np.repeat(np.arange(len(length)), counts)
+    point = np.concatenate([np.asarray(c, dtype=np.intp) for c in candidates])
+
+    # Foot of each point on each candidate segment, as a fraction t of the segment, kept
+    # to 1-D arrays as there are several candidates per point
+    rx, ry = x[point] - start[segment, 0], y[point] - start[segment, 1]
+    sx, sy, sl = dx[segment], dy[segment], length[segment]
+    t = (rx * sx + ry * sy) / (sl * sl)
+    foot = np.clip(t, 0, 1)
+    distance = np.hypot(rx - foot * sx, ry - foot * sy)
+
+    # Nearest segment of each point, the first one on a tie: pairs come in segment order
+    nearest_distance = np.full(len(x), np.inf)
+    np.minimum.at(nearest_distance, point, distance)
+    nearest = np.flatnonzero(distance == nearest_distance[point])
+    point, first = np.unique(point[nearest], return_index=True)
+    nearest = nearest[first]
+
+    segment, t, distance = segment[nearest], t[nearest], distance[nearest]
+    keep = (distance <= max_offset) & ~(open_start[segment] & (t < 0)) & ~(open_end[segment] & (t > 1))
+    point, segment, t, distance, nearest = point[keep], segment[keep], t[keep], distance[keep], nearest[keep]
+    chainage[point] = start_chainage[segment] + np.clip(t, 0, 1) * length[segment]
+    # Distance to the line, on the side given by the cross product with the segment
+    side = sx[nearest] * ry[nearest] - sy[nearest] * rx[nearest]
+    offset[point] = np.where(side < 0, -distance, distance)
+    return chainage, offset
+
+def bin_edges(geometries, spacing):
+    # Edges of the bins of width spacing covering the length of the projected geometries;
+    # the last bin may be shorter
+    line_length = line_segments(geometries)[-1]
+    edges = np.arange(0.0, line_length, float(spacing))
+    return np.append(edges, line_length) if len(edges) else np.array([0.0, line_length])
+
+def bin_along_track(chainage, values, edges, reducer, weights=None):
+    # (pixels per bin, reduced value per bin) of the values with finite chainage and value
+    if isinstance(reducer, str):
+        if reducer not in REDUCERS:
+            raise ValueError(f"Unknown reducer: {reducer}")
+        reducer = REDUCERS[reducer]
+    nbins = len(edges) - 1
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+
+    valid = np.isfinite(chainage) & np.isfinite(values)
+    bins = np.clip(np.searchsorted(edges, chainage[valid], side='right') - 1, 0, nbins - 1)
+    values, weights = values[valid].astype(float), weights[valid]
+    order = np.lexsort((values, bins))
+    bins, values, weights = bins[order], values[order], weights[order]
+
+    count = np.bincount(bins, minlength=nbins)
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    return count, reducer(values, weights, bins, start, count)
+
+def _per_bin(total, count):
+    return np.divide(total, count, out=np.full(len(count), np.nan), where=count > 0)
+
+def reduce_median(values, weights, bins, start, count):
+    reduced = np.full(len(count), np.nan)
+    filled = count > 0
+    low = start[filled] + (count[filled] - 1) // 2
+    high = start[filled] + count[filled] // 2
+    reduced[filled] = (values[low] + values[high]) / 2
+    return reduced
+
+def reduce_mean(values, weights, bins, start, count):
+    return _per_bin(np.bincount(bins, values, minlength=len(count)), count)
+
+def reduce_trimmed_mean(values, weights, bins, start, count):
+    # Mean of each bin after dropping TRIM_FRACTION of its values at either end
+    cut = np.floor(count * TRIM_FRACTION).astype(int)
+    rank = np.arange(len(values)) - start[bins]
+    keep = (rank >= cut[bins]) & (rank < (count - cut)[bins])
+    return _per_bin(np.bincount(bins[keep], values[keep], minlength=len(count)), count - 2 * cut)
+
+def reduce_weighted_mean(values, weights, bins, start, count):
+    # Mean weighted by water_frac, clipped to [0, 1]; bins without weight are NaN
+    weights = np.clip(np.nan_to_num(weights), 0, 1)
+    return _per_bin(np.bincount(bins, weights * values, minlength=len(count)),
+                    np.bincount(bins, weights, minlength=len(count)))
+
+def reduce_mad(values, weights, bins, start, count):
+    # Mean of each bin's values within MAD_THRESHOLD robust standard deviations of its median
+    median = reduce_median(values, weights, bins, start, count)
+    deviation = np.abs(values - median[bins])
+    order = np.lexsort((deviation, bins))
+    mad = reduce_median(deviation[order], weights, bins, start, count)
+    keep = deviation <= (MAD_THRESHOLD * MAD_SCALE * mad)[bins]
+    return _per_bin(np.bincount(bins[keep], values[keep], minlength=len(count)),
+                    np.bincount(bins[keep], minlength=len(count)))
+
+REDUCERS = {
+    'median': reduce_median,
+    'mean': reduce_mean,
+    'trimmed_mean': reduce_trimmed_mean,
+    'weighted_mean': reduce_weighted_mean,
+    'mad': reduce_mad,
+}
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from shapely import get_coordinates, to_wkb
+from shapely.geometry import shape
+from scipy.spatial import cKDTree
+
+
+# Shapely geometries of a GeoJSON FeatureCollection, Feature or bare geometry (dict)
+def geojson_geometries(geojson):
+    if geojson.get('type') == 'FeatureCollection':
+        return [shape(feature['geometry']) for feature in geojson['features']]
+    if geojson.get('type') == 'Feature':
+        return [shape(geojson['geometry'])]
+    return [shape(geojson)]
+
+# Geometries, CRS and feature properties of a centerline: a GeoJSON file or an already
+# parsed FeatureCollection, read with the json module, or any other file GDAL reads,
+# through geopandas (imported only then, as it is slow to import). GeoJSON is lon/lat
+# unless it names another CRS in the old 'crs' member.
+def read_centerline(geojson):
+    if not isinstance(geojson, dict):
+        if os.path.splitext(str(geojson))[1].lower() not in ('.json', '.geojson'):
+            import geopandas as gpd
+            gdf = gpd.read_file(geojson)
+            return (np.asarray(gdf.geometry.values), str(gdf.crs),
+                    gdf.drop(columns=gdf.geometry.name).to_dict('records'))
+        with open(geojson) as f:
+            geojson = json.load(f)
+    features = geojson['features'] if geojson.get('type') == 'FeatureCollection' else [geojson]
+    crs = ((geojson.get('crs') or {}).get('properties') or {}).get('name', 'EPSG:4326')
+    return (np.array(geojson_geometries(geojson), dtype=object), crs,
+            [feature.get('properties') or {} for feature in features])
+
+# Hash of the geometries only, in order: formatting and feature properties do not change it
+def geometry_hash(geometries):
+    digest = hashlib.sha256()
+    for geometry in geometries:
+        digest.update(to_wkb(geometry, byte_order=1))
+    return digest.hexdigest()
+
+# Vertex arrays of a projected LineString or MultiLineString, parts in stream order
+def line_parts(geometry):
+    if geometry.geom_type == 'MultiLineString':
+        parts = [get_coordinates(part) for part in geometry.geoms]
+    else:
+        parts = [get_coordinates(geometry)]
+    return parts
+
+# Place stations every `spacing` metres along one feature, like line.interpolate.
+# Parts of a MultiLineString are walked one after the other; the gap between
+# two parts does not count towards the distance along the line.
+def resample_line(geometry, spacing):
+    parts = line_parts(geometry)
+    vertices = np.concatenate(parts)
+
+    # Distance along the line at each vertex, carried over from one part to the next
+    along = []
+    offset = 0.0
+    for part in parts:
+        part_along = offset + np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(part, axis=0).T))])
+        along.append(part_along)
+        offset = part_along[-1]
+    along = np.concatenate(along)
+
+    num_points = int(along[-1] / spacing)
+    distances = np.arange(num_points + 1) * spacing
+
+    # Segment holding each station; side='left' keeps a station that falls on a
+    # part boundary at the end of the earlier part, as shapely does
+    segment = np.clip(np.searchsorted(along, distances, side='left') - 1, 0, len(along) - 2)
+    start, end = along[segment], along[segment + 1]
+    length = end - start
+    t = np.divide(distances - start, length, out=np.zeros_like(distances), where=length > 0)
+    return vertices[segment] + t[:, None] * (vertices[segment + 1] - vertices[segment])
+
+# Resample every feature of a projected GeoSeries in order and compute chainage.
+# Returns station coordinates, the distance from each station to the previous one
+# and the cumulative distance downstream.
+def resample_centerline(geometries, spacing):
+    stations = np.concatenate([resample_line(geometry, float(spacing)) for geometry in geometries])
+    distance_to_prev = np.concatenate([[0.0], np.hypot(*np.diff(stations, axis=0).T)])
+    cumulative_distance = np.cumsum(distance_to_prev)
+    return stations, distance_to_prev, cumulative_distance
+
+# Mask of the points (projected x, y) lying within `buffer_distance` of any feature,
+# matching buffer(cap_style='flat') followed by a 'within' test. The buffer of a part
+# is the union of one rectangle per segment and a round wedge on the outer side of
+# each join, so nothing is kept past either end of a part unless another segment
+# covers it. Candidate (point, segment) pairs come from a KD-tree over the points,
+# so each segment is only tested against the points near it. The two disagree on
+# points near a chord of a round join and where the GEOS buffer of the line folds
+# over itself; benchmarks/check_within_buffer.py compares them.
+def within_buffer(x, y, geometries, buffer_distance):
+    points = np.column_stack((x, y))
+    keep = np.zeros(len(points), dtype=bool)
+    if not len(points):
+        return keep
+    tree = cKDTree(points)
+
+    for geometry in geometries:
+        for part in line_parts(geometry):
+            start, end = part[:-1], part[1:]
+            direction = end - start
+            length = np.hypot(direction[:, 0], direction[:, 1])
+            nonzero = length > 0
+            start, end, direction, length = start[nonzero], end[nonzero], direction[nonzero], length[nonzero]
+            if not len(length):
+                continue
+
+            candidates = tree.query_ball_point((start + end) / 2, length / 2 + buffer_distance)
+            counts = np.array([len(c) for c in candidates])
+            if not counts.sum():
+                continue
+            segment = np.repeat(np.arange(len(length)), counts)
+            point = np.concatenate([np.asarray(c, dtype=np.intp) for c in candidates])
+
+            offset = points[point] - start[segment]
+            along = np.einsum('ij,ij->i', offset, direction[segment])
+            t = along / length[segment] ** 2
+            across = np.abs(direction[segment, 0] * offset[:, 1] - direction[segment, 1] * offset[:, 0]) / length[segment]
+            in_rectangle = (t >= 0) & (t <= 1) & (across < buffer_distance)
+
+            # Join wedge at the start of every segment but the first: past the end of
+            # the previous segment, before the start of this one, within the radius
+            previous = np.maximum(segment - 1, 0)
+            in_wedge = ((segment > 0) & (along <= 0) &
+                        (np.einsum('ij,ij->i', offset, direction[previous]) >= 0) &
+                        (np.hypot(offset[:, 0], offset[:, 1]) < buffer_distance))
+
+            keep[point[in_rectangle | in_wedge]] = True
+
+    return keep
@@ -0,0 +1,117 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+# Client for CMR granule searches, shared by the Flask apps.
+#
+# Requests go through one pooled requests.Session with a timeout. The first page
+# reports the total hit count in the CMR-Hits header, and the remaining pages are
+# then fetched concurrently. Entries are trimmed to the fields the browser uses, and
+# results are kept in a TTL cache keyed by the normalized query.
+
+CMR_URL = os.environ.get('CMR_URL', 'https://cmr.earthdata.nasa.gov/search/granules.json')
+COLLECTION_CONCEPT_ID = "C2799438266-POCLOUD"
+
+def trim_entry(entry):
+    # Keep the granule IDs, the time range and the NetCDF data link(s)
+    links = [link for link in entry.get('links', [])
+             if link.get('href', '').endswith('.nc') and 'data' in link.get('rel', '')]
+    return {
+        'id': entry.get('id'),
+        'title': entry.get('title'),
+        'time_start': entry.get('time_start'),
+        'time_end': entry.get('time_end'),
+        'links': [{'href': link['href'], 'rel': link['rel']} for link in links],
+    }
+
+class CMRClient:
+    def __init__(self, url=CMR_URL, collection_concept_id=COLLECTION_CONCEPT_ID, page_size=2000,
+                 max_workers=4, timeout=30, ttl=300, max_cached=128):
+        self.url = url
+        self.collection_concept_id = collection_concept_id
+        self.page_size = page_size
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _get_page(self, params, page_num):
+        response = self.session.get(self.url, params={**params, 'page_num': page_num}, timeout=self.timeout)
+        if response.status_code != 200:
+            raise Exception(f"Failed to retrieve data: {response.status_code}")
+        return response
+
+    def _fetch(self, params):
+        first = self._get_page(params, 1)
+        entries = first.json().get('feed', {}).get('entry', [])
+        hits = first.headers.get('CMR-Hits')
+
+        if hits is not None:
+            pages = math.ceil(int(hits) / self.page_size)
+            rest = self._executor.map(lambda page_num: self._get_page(params, page_num), range(2, pages + 1))
+            for response in rest:
+                entries.extend(response.json().get('feed', {}).get('entry', []))
+        else:
+            # No hit count: walk the pages until a short one
+            page_num = 1
+            page = entries
+            while len(page) == self.page_size:
+                page_num += 1
+                page = self._get_page(params, page_num).json().get('feed', {}).get('entry', [])
+                entries.extend(page)
+
+        return [trim_entry(entry) for entry in entries]
+
+    def search(self, min_lat, max_lat, min_lng, max_lng, start_date, end_date):
+        params = {
+            "collection_concept_id": self.collection_concept_id,
+            "bounding_box": f"{float(min_lng)},{float(min_lat)},{float(max_lng)},{float(max_lat)}",
+            "temporal": f"{start_date},{end_date}",
+            "page_size": self.page_size,
+        }
+        key = tuple(sorted(params.items()))
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                metrics.cache_lookup('cmr', True)
+                return {'feed': {'entry': cached[1]}}
+        metrics.cache_lookup('cmr', False)
+
+        entries = self._fetch(params)
+
+        with self._lock:
+            now = time.monotonic()
+            for expired in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+                del self._cache[expired]
+            if len(self._cache) >= self.max_cached:
+                del self._cache[min(self._cache, key=lambda k: self._cache[k][0])]
+            self._cache[key] = (now + self.ttl, entries)
+        return {'feed': {'entry': entries}}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = CMRClient()
+    return _client
+
+def query_nasa_data(min_lat, max_lat, min_lng, max_lng, start_date, end_date):
+    return get_client().search(min_lat, max_lat, min_lng, max_lng, start_date, end_date)
@@ -1,152 +1,614 @@
+import json
 import sys
-import geopandas as gpd
+import time
+from collections import OrderedDict
 import pandas as pd
-import xarray as xr
-from shapely.geometry import MultiPoint
-from netCDF4 import Dataset
 import numpy as np
 from scipy.spatial import cKDTree
-from pyproj import CRS
-
-def process_data(netcdf_path, geojson_path, buffer_distance, spacing):
-    # Load NetCDF file
-    nc = Dataset(netcdf_path, 'r')
-    pixel_cloud = nc.groups['pixel_cloud']
-
-    # Extract variables
-    latitude = pixel_cloud.variables['latitude'][:]
-    longitude = pixel_cloud.variables['longitude'][:]
-    height = pixel_cloud.variables['height'][:]
-    water_frac = pixel_cloud.variables['water_frac'][:]
-    coherent_power = pixel_cloud.variables['coherent_power'][:]
-    classification = pixel_cloud.variables['classification'][:]
-    missed_detection_rate = pixel_cloud.variables['missed_detection_rate'][:]
-    geolocation_qual = pixel_cloud.variables['geolocation_qual'][:]
-    nc.close()
-
-
-
-    # Create a pandas DataFrame
-    df_PIXC = pd.DataFrame({
-        'latitude': latitude,
-        'longitude': longitude,
-        'height': height,
-        'water_frac': water_frac,
-        'coherent_power': coherent_power,
-        'classification': classification,
-        'missed_detection_rate': missed_detection_rate,
-        'geolocation_qual': geolocation_qual
-    })
-
-    # Convert the DataFrame to an xarray Dataset
-    ds = xr.Dataset.from_dataframe(df_PIXC)
-
-    # Dynamically detect the UTC EPSG code:
-    def latlon_to_utm_epsg(min_lat, max_lat, min_lon, max_lon):
-        # Use the central longitude of the bounding box to determine the UTM zone
-        central_lon = (min_lon + max_lon) / 2
-        central_lat = (min_lat + max_lat) / 2
-        
-        # Determine the UTM zone
-        utm_zone = int((central_lon + 180) / 6) + 1
-        
-        # Determine the hemisphere based on latitude
-        if central_lat >= 0:
-            epsg_code = CRS.from_dict({'proj': 'utm', 'zone': utm_zone, 'south': False}).to_epsg()
+from centerline import read_centerline, resample_centerline, within_buffer, geometry_hash
+from binning import REDUCERS, bin_along_track, bin_edges, project_to_line
+import shapely
+from projection import extent_epsg, get_transformer, project_geometries, to_utm
+from result_formats import FORMATS, encode_result
+from pixel_index import fill_masked, open_index
+from remote_granule import is_url, open_granule, start_time
+from metrics import span
+
+# Bump when a change alters the output of process_data, so cached results are not reused
+PROCESSOR_VERSION = '2'
+
+# Variables read from the pixel_cloud group
+PIXC_VARIABLES = ['latitude', 'longitude', 'height', 'water_frac', 'coherent_power',
+                  'classification', 'missed_detection_rate', 'geolocation_qual']
+
+# Classes of the pixels that make up a water surface profile: water_near_land, open_water,
+# low_coh_water_near_land and open_low_coh_water (the plot keeps the same ones)
+WATER_CLASSES = (3, 4, 6, 7)
+
+# Dynamically detect the UTM EPSG code from the centre of the bounding box
+def latlon_to_utm_epsg(min_lat, max_lat, min_lon, max_lon):
+    return extent_epsg(min_lat, max_lat, min_lon, max_lon)
+
+def chunk_rows(variable):
+    # Rows per on-disk chunk of a 1-D variable, None if it is stored contiguously
+    chunking = variable.chunking()
+    return chunking[0] if chunking != 'contiguous' else None
+
+def read_rows(variable, rows):
+    # Values of variable at the sorted row numbers rows, reading only the chunks that
+    # hold them (one read per run of consecutive chunks), or the window spanning them
+    # when the variable is not chunked
+    chunk = chunk_rows(variable)
+    if chunk is None or not rows.size:
+        window = slice(rows[0], rows[-1] + 1) if rows.size else slice(0, 0)
+        return variable[window][rows - window.start]
+
+    chunks = np.unique(rows // chunk)
+    breaks = np.flatnonzero(np.diff(chunks) != 1) + 1
+    runs = [(run[0] * chunk, min(variable.shape[0], (run[-1] + 1) * chunk)) for run in np.split(chunks, breaks)]
+    values = np.ma.concatenate([variable[start:stop] for start, stop in runs])
+    # Every chunk before the last one read is whole, so a row's position follows from its chunk's rank
+    return values[np.searchsorted(chunks, rows // chunk) * chunk + rows % chunk]
+
+def read_pixel_cloud(pixel_cloud, latitude, longitude, bounds, variables=PIXC_VARIABLES, offset=0):
+    # Read only the pixels inside bounds (min_lon, min_lat, max_lon, max_lat).
+    # latitude/longitude are already loaded for the mask, starting at row offset; every
+    # other variable is read only from the chunks holding selected pixels, so the bulk
+    # of the granule is never loaded (or, for a remote granule, fetched).
+    min_lon, min_lat, max_lon, max_lat = bounds
+    inside = ((latitude >= min_lat) & (latitude <= max_lat) &
+              (longitude >= min_lon) & (longitude <= max_lon))
+    index = np.flatnonzero(np.ma.filled(inside, False))
+
+    # Masked values become NaN here, once
+    data = {}
+    for name in variables:
+        if name == 'latitude':
+            data[name] = fill_masked(latitude[index])
+        elif name == 'longitude':
+            data[name] = fill_masked(longitude[index])
         else:
-            epsg_code = CRS.from_dict({'proj': 'utm', 'zone': utm_zone, 'south': True}).to_epsg()
-        
-        return epsg_code
-    
-    min_lat, max_lat = latitude.min(), latitude.max()
-    min_lon, max_lon = longitude.min(), longitude.max()
-    epsg_code = latlon_to_utm_epsg(min_lat, max_lat, min_lon, max_lon)
-
-    # Convert GeoJSON line to GeoDataFrame
-    geojson_gdf = gpd.read_file(geojson_path)
-    river = geojson_gdf.to_crs(epsg_code)
-
-    # Buffer the line
-    river_buffered = river.buffer(float(buffer_distance), cap_style='flat')
-    river_buffered_gdf = gpd.GeoDataFrame(geometry=river_buffered, crs=river.crs)
-
-    # Interpolate points along the line
-    def interpolate_points(line, distance):
-        num_points = int(line.length / distance)
-        return MultiPoint([line.interpolate(i * distance) for i in range(num_points + 1)])
-
-    # Apply interpolation
-    points_gdf = river.geometry.apply(lambda x: interpolate_points(x, float(spacing)))
-    points_gdf = points_gdf.explode(index_parts=True).reset_index(drop=True)
-    river_points = gpd.GeoDataFrame(geometry=points_gdf)
-
-    # Calculate cumulative distance
-    def calculate_cumulative_distance(gdf):
-        gdf['prev_geometry'] = gdf['geometry'].shift()
-        gdf['distance_to_prev'] = gdf.apply(lambda row: row['geometry'].distance(row['prev_geometry']) if pd.notna(row['prev_geometry']) else 0, axis=1)
-        gdf['cumulative_distance'] = gdf['distance_to_prev'].cumsum()
-        return gdf
-
-    
-    river = calculate_cumulative_distance(river_points)
-    river.reset_index(drop=True, inplace=True)
-
-    river_cum_dis = river['cumulative_distance'].values
-
-    river_buffered_gdf = river_buffered_gdf.to_crs('epsg:4326')
-
-    # Convert 'ds' to GeoDataFrame and clip to buffer
-    ds_gdf = gpd.GeoDataFrame({
-        'latitude': latitude,
-        'longitude': longitude,
-        'height': height,
-        'water_frac': water_frac,
-        'coherent_power': coherent_power,
-        'classification': classification,
-        'missed_detection_rate': missed_detection_rate,
-        'geolocation_qual': geolocation_qual
-    }, geometry=gpd.points_from_xy(df_PIXC['longitude'], df_PIXC['latitude']), crs="EPSG:4326")
-    ds_clipped = gpd.sjoin(ds_gdf, river_buffered_gdf, how='inner', predicate='within')
+            data[name] = fill_masked(read_rows(pixel_cloud.variables[name], offset + index))
+    return data
 
-    # Find nearest river point to each ds point
-    river = river.to_crs(epsg_code)  # You may need to dynamically determine the EPSG code
-    ds_clipped = ds_clipped.to_crs(epsg_code)
-    ds_coords_utm = np.column_stack((ds_clipped.geometry.x, ds_clipped.geometry.y))
-    river_coords_utm = np.column_stack((river.geometry.x, river.geometry.y))
+# Row ranges of the pixel_cloud group holding at most max_batch_rows pixels each. Batches
+# are a whole number of on-disk chunks when the chunks fit, so each HDF5 chunk is
+# decompressed once.
+def pixel_batches(pixel_cloud, max_batch_rows):
+    latitude = pixel_cloud.variables['latitude']
+    size = latitude.shape[0]
+    chunking = latitude.chunking()
+    chunk = chunking[0] if chunking != 'contiguous' else 1
+    batch_rows = max_batch_rows // chunk * chunk if chunk <= max_batch_rows else max_batch_rows
+    for start in range(0, size, batch_rows):
+        yield slice(start, min(size, start + batch_rows))
+
+# Resampled stations and their KD-tree per (centerline, spacing, EPSG), kept per process
+# so re-running a reach against another granule skips the resampling
+STATION_CACHE_SIZE = 32
+_station_cache = OrderedDict()
+
+def centerline_stations(geometries, crs, river, spacing, epsg_code):
+    # geometries in crs, as read; river, the same projected to epsg_code
+    key = (geometry_hash(geometries), crs, float(spacing), epsg_code)
+    if key in _station_cache:
+        _station_cache.move_to_end(key)
+        return _station_cache[key]
+
+    stations, distance_to_prev, cumulative_distance = resample_centerline(river, float(spacing))
+    entry = (stations, distance_to_prev, cumulative_distance, cKDTree(stations))
+    _station_cache[key] = entry
+    if len(_station_cache) > STATION_CACHE_SIZE:
+        _station_cache.popitem(last=False)
+    return entry
 
-    tree_river = cKDTree(river_coords_utm)
+def reach_ids_of(properties, reach_field):
+    # One ID per feature, taken from its reach_field property
+    if not any(reach_field in feature for feature in properties):
+        raise ValueError(f"Features have no '{reach_field}' property")
+    reach_ids = pd.Series([feature.get(reach_field) for feature in properties])
+    if reach_ids.isna().any():
+        raise ValueError(f"Every feature needs a '{reach_field}' property")
+    if reach_ids.duplicated().any():
+        raise ValueError(f"Duplicate {reach_field}: {', '.join(map(str, reach_ids[reach_ids.duplicated()].unique()))}")
+    return reach_ids.to_numpy()
 
+def reach_stations(geometries, crs, river, spacing, epsg_code):
+    # Stations of each feature resampled on its own, so chainage restarts at 0 on every
+    # reach, with one KD-tree per reach. Cached like centerline_stations, as one entry
+    # for the whole network.
+    key = ('reaches', geometry_hash(geometries), crs, float(spacing), epsg_code)
+    if key in _station_cache:
+        _station_cache.move_to_end(key)
+        return _station_cache[key]
+
+    reaches = []
+    for geometry in river:
+        stations, distance_to_prev, cumulative_distance = resample_centerline([geometry], float(spacing))
+        reaches.append((stations, distance_to_prev, cumulative_distance, cKDTree(stations)))
+    _station_cache[key] = reaches
+    if len(_station_cache) > STATION_CACHE_SIZE:
+        _station_cache.popitem(last=False)
+    return reaches
+
+def clip_pixels(x, y, clip_mode, river_buffered, centerline, buffer_distance):
+    # Rows of the pixels (UTM x, y) inside the river buffer, and the position of the
+    # buffer polygon holding each in 'within' mode (None in 'distance' mode)
+    if clip_mode == 'within':
+        # Pixels strictly inside each buffer polygon, as a spatial join with predicate
+        # 'within' would give: a pixel inside several polygons is listed once per polygon
+        left, right = [], []
+        for position, polygon in enumerate(river_buffered):
+            shapely.prepare(polygon)
+            inside = np.flatnonzero(shapely.contains_xy(polygon, x, y))
+            left.append(inside)
+            right.append(np.full(len(inside), position))
+        left, right = np.concatenate(left), np.concatenate(right)
+        order = np.lexsort((right, left))
+        return left[order], right[order]
+    # Keep those within the buffer distance of the line
+    return np.flatnonzero(within_buffer(x, y, centerline, float(buffer_distance))), None
+
+def match_stations(ds_coords_utm, tree_river, river_cum_dis):
+    # Find nearest river point to each ds point
     distances, indices = tree_river.query(ds_coords_utm)
 
     nearest_GNSS_dist = river_cum_dis[indices]
 
-    ds_clipped['nearest_GNSS_dist'] = nearest_GNSS_dist
-    ds_clipped['nearest_index'] = indices
-    ds_clipped['distance_to_nearest'] = distances
+    return {'nearest_GNSS_dist': nearest_GNSS_dist, 'nearest_index': indices, 'distance_to_nearest': distances}
+
+def nearest_reach(ds_coords_utm, centerline):
+    # Position of the reach whose centerline is nearest to each pixel, the first one on a tie
+    if len(ds_coords_utm) and len(centerline) > 1:
+        return shapely.STRtree(centerline).nearest(shapely.points(ds_coords_utm))
+    return np.zeros(len(ds_coords_utm), dtype=np.intp)
+
+def match_reaches(ds_coords_utm, centerline, reaches):
+    # Assign each pixel to the reach whose centerline is nearest to it, then to the
+    # nearest station of that reach. nearest_index numbers the stations of all reaches in
+    # order; nearest_GNSS_dist is the chainage along the reach.
+    reach = nearest_reach(ds_coords_utm, centerline)
+
+    distances = np.zeros(len(ds_coords_utm))
+    indices = np.zeros(len(ds_coords_utm), dtype=np.intp)
+    nearest_GNSS_dist = np.zeros(len(ds_coords_utm))
+    offset = 0
+    for position, (stations, _, cumulative_distance, tree) in enumerate(reaches):
+        selected = np.flatnonzero(reach == position)
+        if len(selected):
+            distances[selected], local = tree.query(ds_coords_utm[selected])
+            indices[selected] = offset + local
+            nearest_GNSS_dist[selected] = cumulative_distance[local]
+        offset += len(stations)
+
+    return {'nearest_GNSS_dist': nearest_GNSS_dist, 'nearest_index': indices, 'distance_to_nearest': distances}
+
+def merge_stations(station_columns, pixel_columns):
+    # Left join of the pixel columns onto the station columns by nearest_index, as
+    # DataFrame.merge(how='left') gives it: stations in order, each followed by its
+    # pixels in their order, or one row without pixel values if it has none. Integer
+    # pixel columns become float64 with NaN in those rows, as they do in pandas.
+    nearest_index = pixel_columns['nearest_index']
+    stations = len(next(iter(station_columns.values())))
+    counts = np.bincount(nearest_index, minlength=stations)
+    rows = np.maximum(counts, 1)
+    station = np.repeat(np.arange(stations), rows)
+    matched = np.repeat(counts > 0, rows)
+    pixel = np.argsort(nearest_index, kind='stable')
+
+    columns = {name: values[station] for name, values in station_columns.items()}
+    for name, values in pixel_columns.items():
+        if name == 'nearest_index':
+            columns[name] = station
+        elif matched.all():
+            columns[name] = values[pixel]
+        else:
+            column = np.full(len(station), np.nan, dtype=values.dtype if values.dtype.kind == 'f' else np.float64)
+            column[matched] = values[pixel]
+            columns[name] = column
+    return pd.DataFrame(columns, copy=False)
+
+def project_pixels(ds_coords_utm, centerline, reach_ids, buffer_distance):
+    # Chainage and signed cross-track offset of each pixel along the line (see binning),
+    # NaN past a loose end. With reaches, each pixel is projected onto its nearest reach
+    # and chainage restarts at 0 on every reach.
+    x, y = ds_coords_utm[:, 0], ds_coords_utm[:, 1]
+    if reach_ids is None:
+        chainage, offset = project_to_line(x, y, centerline, float(buffer_distance))
+        return {'chainage': chainage, 'cross_track_offset': offset}
+
+    reach = nearest_reach(ds_coords_utm, centerline)
+    chainage, offset = np.full(len(x), np.nan), np.full(len(x), np.nan)
+    for position, geometry in enumerate(centerline):
+        selected = np.flatnonzero(reach == position)
+        chainage[selected], offset[selected] = project_to_line(x[selected], y[selected], [geometry],
+                                                               float(buffer_distance))
+    return {'chainage': chainage, 'cross_track_offset': offset, 'reach': reach}
+
+def profile_bins(pixel_columns, centerline, reach_ids, spacing, reducer):
+    # One row per bin of width spacing along the line (per reach, numbered across all of
+    # them), with the heights of its water pixels reduced by reducer (see
+    # binning.REDUCERS; 'weighted_mean' weights by water_frac), their count and their
+    # median cross-track offset
+    water = np.isin(pixel_columns['classification'], WATER_CLASSES)
+    reaches = [(None, centerline, water)] if reach_ids is None else [
+        (reach_ids[position:position + 1], [geometry], water & (pixel_columns['reach'] == position))
+        for position, geometry in enumerate(centerline)]
+
+    rows = []
+    for reach_id, geometries, selected in reaches:
+        edges = bin_edges(geometries, spacing)
+        chainage = pixel_columns['chainage'][selected]
+        pixels, height = bin_along_track(chainage, pixel_columns['height'][selected], edges, reducer,
+                                         pixel_columns['water_frac'][selected])
+        _, offset = bin_along_track(chainage, pixel_columns['cross_track_offset'][selected], edges, 'median')
+        columns = {} if reach_id is None else {'reach_id': np.repeat(reach_id, len(pixels))}
+        columns.update({
+            'chainage_start': edges[:-1],
+            'chainage_end': edges[1:],
+            'chainage': (edges[:-1] + edges[1:]) / 2,
+            'pixels': pixels,
+            'height': height,
+            'cross_track_offset': offset
+        })
+        rows.append(columns)
+
+    columns = {name: np.concatenate([reach[name] for reach in rows]) for name in rows[0]}
+    return pd.DataFrame({'bin': np.arange(len(columns['chainage'])), **columns})
 
-    # Merge DataFrames
-    columns_to_keep = [col for col in ds_clipped.columns if col not in river.columns or col == 'nearest_index']
+def process_data(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode='within', progress=None,
+                 max_batch_rows=None, index_dir=None, reach_field=None, memory=None, geometry=False, profile=None):
+    # clip_mode='within' clips pixels with a flat-capped buffer polygon and a spatial join;
+    # clip_mode='distance' projects the pixels to UTM once and keeps those within
+    # buffer_distance of the centerline, without building the polygon.
+    # max_batch_rows, if given, streams the granule in batches of at most that many
+    # pixels, clipping and matching each batch and keeping only the survivors, so
+    # memory no longer grows with the size of the granule.
+    # index_dir, if given, reads the pixels through the granule's spatial index kept
+    # there (see pixel_index), building it on first use; later reaches against the same
+    # granule then read only the index cells around the line. It takes precedence over
+    # max_batch_rows.
+    # netcdf_path may be an http(s) URL, in which case the granule is read over range
+    # requests (see remote_granule) and only the chunks it needs are fetched.
+    # memory, if given, holds the granule's bytes and netcdf_path only names it.
+    # geojson_path may also be a parsed GeoJSON FeatureCollection.
+    # reach_field, if given, treats every feature as a separate reach identified by that
+    # property: all reaches are clipped and matched in the same pass over the pixels, a
+    # pixel inside several buffers goes to the reach with the nearest centerline, and
+    # the stations of every reach come back in one table with a reach_id column.
+    # geometry=True returns a GeoDataFrame with each row's station as a UTM Point;
+    # otherwise no geometry objects are made.
+    # profile, if given, names a reducer (see binning.REDUCERS) and returns the water
+    # surface profile instead of the station table: the clipped pixels are projected onto
+    # the line and binned every spacing metres of chainage (see profile_bins), without
+    # the KD-tree and merge, and pixels past either end of the line are left out.
+    # progress, if given, is called with the name of each stage as it starts. The start
+    # time of a granule read from the file (not the pixel index) is returned in the
+    # result's attrs['granule_time'], as an ISO string since attrs are saved with the
+    # table in Parquet, so batches need not open it again.
+    #
+    # Pixels are kept as a dict of plain NumPy columns, with masked values turned into
+    # NaN once as they are read. Clipping and matching select rows by index, so only the
+    # surviving pixels are copied, and the one DataFrame is built by the final merge.
+    if clip_mode not in ('within', 'distance'):
+        raise ValueError(f"Unknown clip mode: {clip_mode}")
+    if profile is not None and profile not in REDUCERS:
+        raise ValueError(f"Unknown reducer: {profile}")
+    if profile is not None and geometry:
+        raise ValueError("Profiles have no station geometry")
+    if progress:
+        progress('clipping')
 
-    ds_clipped_subset = ds_clipped[columns_to_keep]
-    merged_df = river.merge(ds_clipped_subset, left_index=True, right_on='nearest_index', how='left')
-    merged_df = pd.DataFrame(merged_df.drop(columns=['geometry','prev_geometry']))
-    merged_df = merged_df.reset_index(drop=True)  # Resets the index, making it unique
+    if is_url(netcdf_path) or memory is not None:
+        # A remote or in-memory granule is read in place; the index needs a local copy
+        index_dir = None
 
+    with span('open', granule=str(netcdf_path)):
+        if index_dir:
+            # The index was projected to the granule's UTM zone when it was built
+            index = open_index(netcdf_path, index_dir, PIXC_VARIABLES, latlon_to_utm_epsg)
+            epsg_code = index.epsg_code
+            granule_start = None
+        else:
+            # Load NetCDF file, or open it over HTTP range requests if given a URL
+            nc = open_granule(netcdf_path, memory)
+            pixel_cloud = nc.groups['pixel_cloud']
+            granule_start = start_time(nc).isoformat()
+
+            # Pick the UTM zone from the granule extent
+            if max_batch_rows:
+                extent = []
+                for batch in pixel_batches(pixel_cloud, max_batch_rows):
+                    latitude = pixel_cloud.variables['latitude'][batch]
+                    longitude = pixel_cloud.variables['longitude'][batch]
+                    extent.append((latitude.min(), latitude.max(), longitude.min(), longitude.max()))
+                extent = np.ma.array(extent)
+                min_lat, max_lat = extent[:, 0].min(), extent[:, 1].max()
+                min_lon, max_lon = extent[:, 2].min(), extent[:, 3].max()
+            else:
+                latitude = pixel_cloud.variables['latitude'][:]
+                longitude = pixel_cloud.variables['longitude'][:]
+                min_lat, max_lat = latitude.min(), latitude.max()
+                min_lon, max_lon = longitude.min(), longitude.max()
+            epsg_code = latlon_to_utm_epsg(min_lat, max_lat, min_lon, max_lon)
+
+    # Read the line and project it to the granule's UTM zone
+    geometries, crs, properties = read_centerline(geojson_path)
+    river = project_geometries(geometries, crs, epsg_code)
+
+    reach_ids = reach_ids_of(properties, reach_field) if reach_field else None
+
+    # Buffer the line; pixels are clipped in UTM, so the buffer stays in UTM
+    river_buffered = None
+    if clip_mode == 'within':
+        # quad_segs=16, as GeoSeries.buffer uses
+        river_buffered = shapely.buffer(river, float(buffer_distance), quad_segs=16, cap_style='flat')
+        if reach_ids is not None:
+            # One polygon for the whole network, so each pixel is tested and kept once
+            river_buffered = [shapely.union_all(river_buffered)]
+
+    # Envelope of the line grown by the buffer distance, in lon/lat for reading the granule
+    min_x, min_y, max_x, max_y = shapely.total_bounds(river)
+    bounds = get_transformer('EPSG:4326', epsg_code).transform_bounds(
+        min_x - float(buffer_distance), min_y - float(buffer_distance),
+        max_x + float(buffer_distance), max_y + float(buffer_distance), direction='INVERSE')
+
+    # Resample stations along the line and compute chainage; profiles bin by chainage instead
+    with span('stations') as stage:
+        if profile is not None:
+            stations = station_columns = ()
+        elif reach_ids is None:
+            stations, distance_to_prev, cumulative_distance, tree_river = centerline_stations(
+                geometries, crs, river, spacing, epsg_code)
+            station_columns = {
+                'distance_to_prev': distance_to_prev,
+                'cumulative_distance': cumulative_distance
+            }
+        else:
+            reaches = reach_stations(geometries, crs, river, spacing, epsg_code)
+            stations = np.concatenate([reach[0] for reach in reaches])
+            station_columns = {
+                'reach_id': np.repeat(reach_ids, [len(reach[0]) for reach in reaches]),
+                'distance_to_prev': np.concatenate([reach[1] for reach in reaches]),
+                'cumulative_distance': np.concatenate([reach[2] for reach in reaches])
+            }
+        stage.rows_out = len(stations)
+
+    river_cum_dis = station_columns['cumulative_distance'] if profile is None else None
+
+    # Each stage of the pixel path is timed as a span (see metrics)
+    def read(latitude, longitude, offset=0):
+        with span('read', rows_in=len(latitude)) as stage:
+            pixels = read_pixel_cloud(pixel_cloud, latitude, longitude, bounds, offset=offset)
+            stage.rows_out = len(pixels['latitude'])
+        return pixels
+
+    def clip_and_match(pixels, coords=None):
+        # The surviving pixels' columns, with the matching station's columns added
+        with span('clip', rows_in=len(pixels['latitude'])) as stage:
+            # Project the pixels once, as raw arrays, unless they come projected from the index
+            x, y = coords if coords is not None else to_utm(pixels['longitude'], pixels['latitude'], epsg_code)
+            rows, index_right = clip_pixels(x, y, clip_mode, river_buffered, river, buffer_distance)
+            ds_clipped = {name: values[rows] for name, values in pixels.items()}
+            if index_right is not None and reach_ids is None:
+                # The union buffer of a network leaves nothing for index_right to point at
+                ds_clipped['index_right'] = index_right
+            ds_coords_utm = np.column_stack((x[rows], y[rows]))
+            stage.rows_out = len(rows)
+        if profile is not None:
+            with span('project', rows_in=len(rows)) as stage:
+                ds_clipped.update(project_pixels(ds_coords_utm, river, reach_ids, buffer_distance))
+                stage.rows_out = int(np.isfinite(ds_clipped['chainage']).sum())
+            return ds_clipped
+        with span('match', rows_in=len(rows)) as stage:
+            if reach_ids is None:
+                ds_clipped.update(match_stations(ds_coords_utm, tree_river, river_cum_dis))
+            else:
+                ds_clipped.update(match_reaches(ds_coords_utm, river, reaches))
+            stage.rows_out = len(rows)
+        return ds_clipped
+
+    if index_dir:
+        # Read the index cells overlapping the line's envelope grown by the buffer distance
+        min_x, min_y, max_x, max_y = shapely.total_bounds(river)
+        with span('read') as stage:
+            pixels = index.read(min_x - float(buffer_distance), min_y - float(buffer_distance),
+                                max_x + float(buffer_distance), max_y + float(buffer_distance), PIXC_VARIABLES)
+            coords = (pixels.pop('x'), pixels.pop('y'))
+            del pixels['row']
+            stage.rows_out = len(coords[0])
+        if progress:
+            progress('matching')
+        ds_clipped = clip_and_match(pixels, coords)
+    elif max_batch_rows:
+        # Clip and match one batch at a time, keeping only the surviving pixels
+        batches = []
+        for batch in pixel_batches(pixel_cloud, max_batch_rows):
+            latitude = pixel_cloud.variables['latitude'][batch]
+            longitude = pixel_cloud.variables['longitude'][batch]
+            pixels = read(latitude, longitude, batch.start)
+            if not len(pixels['latitude']):
+                continue
+            batches.append(clip_and_match(pixels))
+        if not batches:
+            batches.append(clip_and_match(read_pixel_cloud(pixel_cloud, latitude[:0], longitude[:0], bounds)))
+        nc.close()
+        if progress:
+            progress('matching')
+        ds_clipped = {name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]}
+    else:
+        # Extract variables for the pixels inside the buffer envelope only
+        pixels = read(latitude, longitude)
+        del latitude, longitude
+        nc.close()
+        if progress:
+            progress('matching')
+        ds_clipped = clip_and_match(pixels)
+
+    if profile is not None:
+        with span('bin', rows_in=len(ds_clipped['chainage'])) as stage:
+            profile_df = profile_bins(ds_clipped, river, reach_ids, spacing, profile)
+            stage.rows_out = len(profile_df)
+        if granule_start is not None:
+            profile_df.attrs['granule_time'] = granule_start
+        return profile_df
+
+    # Merge the pixels onto the stations
+    with span('merge', rows_in=len(ds_clipped['nearest_index'])) as stage:
+        merged_df = merge_stations(station_columns, ds_clipped)
+        if geometry:
+            # geopandas is only imported for callers that want a GeoDataFrame
+            import geopandas as gpd
+            station = merged_df['nearest_index'].to_numpy()
+            merged_df = gpd.GeoDataFrame(merged_df, geometry=gpd.points_from_xy(stations[station, 0], stations[station, 1]),
+                                         crs=epsg_code)
+        stage.rows_out = len(merged_df)
+
+    if granule_start is not None:
+        merged_df.attrs['granule_time'] = granule_start
     return merged_df
 
-if __name__ == "__main__":
-    netcdf_path = sys.argv[1]
-    geojson_path = sys.argv[2]
-    buffer_distance = float(sys.argv[3])
-    spacing = float(sys.argv[4])
+def batch_main(argv):
+    # python external_processor.py batch <geojson> <buffer> <spacing> <granule.nc>... [--workers N] [--output table.parquet]
+    #                                    [--reach-field NAME] [--profile REDUCER]
+    import argparse
+    from batch import process_batch
+
+    parser = argparse.ArgumentParser(prog='external_processor.py batch')
+    parser.add_argument('geojson_path')
+    parser.add_argument('buffer_distance', type=float)
+    parser.add_argument('spacing', type=float)
+    parser.add_argument('netcdf_paths', nargs='+')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--clip-mode', default='within', choices=['within', 'distance'])
+    parser.add_argument('--format', default='json', choices=list(FORMATS))
+    parser.add_argument('--output', help='Write the table to this Parquet file instead of stdout')
+    parser.add_argument('--reach-field', help='Treat each feature as a reach identified by this property')
+    parser.add_argument('--profile', choices=list(REDUCERS),
+                        help='Return the binned water surface profile, reduced this way, instead of the pixels')
+    args = parser.parse_args(argv)
+
+    try:
+        result = process_batch(args.netcdf_paths, args.geojson_path, args.buffer_distance, args.spacing,
+                               workers=args.workers, clip_mode=args.clip_mode, reach_field=args.reach_field,
+                               profile=args.profile)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if args.output:
+        result.to_parquet(args.output)
+    else:
+        write_result(result.reset_index(), args.format)
+
+def write_result(result, fmt):
+    # JSON is printed as text; the binary formats go to stdout as raw bytes
+    payload, _ = encode_result(result, fmt)
+    sys.stdout.buffer.write(payload)
+    if fmt == 'json':
+        sys.stdout.buffer.write(b'\n')
+    sys.stdout.flush()
+
+# Keys of a --serve job spec passed on to process_data
+SERVE_JOB_KEYS = ('netcdf_path', 'geojson_path', 'buffer_distance', 'spacing', 'clip_mode', 'index_dir', 'reach_field',
+                  'max_batch_rows', 'profile')
+
+def serve_job(spec, index_dir=None):
+    # Run one --serve job spec; returns the response line as a dict
+    start = time.perf_counter()
+    response = {'id': spec.get('id')}
+    try:
+        unknown = set(spec) - set(SERVE_JOB_KEYS) - {'id', 'format', 'output'}
+        if unknown:
+            raise ValueError(f"Unknown job keys: {', '.join(sorted(unknown))}")
+        missing = [key for key in SERVE_JOB_KEYS[:4] if key not in spec]
+        if missing:
+            raise ValueError(f"Missing job keys: {', '.join(missing)}")
+        fmt = spec.get('format', 'json')
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format: {fmt}")
+        if fmt != 'json' and not spec.get('output'):
+            raise ValueError(f"The {fmt} format needs an output path")
+
+        kwargs = {key: spec[key] for key in SERVE_JOB_KEYS if key in spec}
+        kwargs.setdefault('index_dir', index_dir)
+        result = process_data(**kwargs)
+        payload, _ = encode_result(result, fmt)
+        if spec.get('output'):
+            with open(spec['output'], 'wb') as f:
+                f.write(payload)
+            response['output'] = spec['output']
+        else:
+            response['result'] = json.loads(payload)
+        response['rows'] = len(result)
+    except Exception as e:
+        response['error'] = str(e)
+    response['seconds'] = time.perf_counter() - start
+    return response
+
+def serve_main(argv):
+    # python external_processor.py --serve [--index-dir DIR]
+    #
+    # Stays resident and reads one JSON job spec per line on stdin, e.g.
+    #   {"id": 1, "netcdf_path": "granule.nc", "geojson_path": "reach.geojson", "buffer_distance": 100, "spacing": 50}
+    # with any of clip_mode, index_dir, reach_field, max_batch_rows and profile as well. geojson_path
+    # may also be the FeatureCollection itself. One JSON line is written to stdout per job,
+    # in order: {"id", "result", "rows", "seconds"}, with the result as JSON, or, if the
+    # spec gave an "output" path, {"id", "output", "rows", "seconds"} with the result
+    # written there in "format" (json, arrow, parquet or npz). A failed job answers
+    # {"id", "error", "seconds"} and the next one is read. The geo stack is imported once,
+    # and the station cache and open transformers are kept from one job to the next.
+    import argparse
+    # Read by the first job otherwise; imported here so it does not pay for it
+    import netCDF4  # noqa: F401
+
+    parser = argparse.ArgumentParser(prog='external_processor.py --serve')
+    parser.add_argument('--serve', action='store_true', required=True)
+    parser.add_argument('--index-dir', help='Read granules through their spatial index in this directory by default')
+    args = parser.parse_args(argv)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+            if not isinstance(spec, dict):
+                raise ValueError("A job spec must be a JSON object")
+        except ValueError as e:
+            response = {'id': None, 'error': f"Bad job spec: {e}"}
+        else:
+            response = serve_job(spec, args.index_dir)
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == 'batch':
+    batch_main(sys.argv[2:])
+elif __name__ == "__main__" and '--serve' in sys.argv[1:]:
+    serve_main(sys.argv[1:])
+elif __name__ == "__main__":
+    # python external_processor.py <granule.nc> <geojson> <buffer> <spacing> [clip_mode] [--format json|arrow|parquet|npz]
+    #                              [--index-dir DIR] [--reach-field NAME] [--profile REDUCER]
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='external_processor.py')
+    parser.add_argument('netcdf_path')
+    parser.add_argument('geojson_path')
+    parser.add_argument('buffer_distance', type=float)
+    parser.add_argument('spacing', type=float)
+    parser.add_argument('clip_mode', nargs='?', default='within', choices=['within', 'distance'])
+    parser.add_argument('--format', default='json', choices=list(FORMATS))
+    parser.add_argument('--index-dir', help='Read the granule through its spatial index in this directory')
+    parser.add_argument('--reach-field', help='Treat each feature as a reach identified by this property')
+    parser.add_argument('--profile', choices=list(REDUCERS),
+                        help='Return the binned water surface profile, reduced this way, instead of the pixels')
+    args = parser.parse_args()
 
     try:
-        result = process_data(netcdf_path, geojson_path, buffer_distance, spacing)
-        result_json = result.to_json()  # Convert DataFrame to JSON
-        print(result_json)  # Output result as JSON
+        result = process_data(args.netcdf_path, args.geojson_path, args.buffer_distance, args.spacing, args.clip_mode,
+                              index_dir=args.index_dir, reach_field=args.reach_field, profile=args.profile)
+        write_result(result, args.format)  # Output result as JSON or a binary format
     except Exception as e:
         print(f"Error processing data you dummy: {e}", file=sys.stderr)
-        print(result.head())
+        sys.exit(1)
 
         
 
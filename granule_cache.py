@@ -0,0 +1,164 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+import metrics
+
+
+# Delete the least recently modified files matching pattern until the total size is
+# within max_bytes, skipping files whose stem is in keep
+def evict_lru(directory, pattern, max_bytes, keep=()):
+    # Returns the stems of the deleted entries
+    entries = []
+    for entry in Path(directory).glob(pattern):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry.stem in keep:
+            continue
+        entry.unlink(missing_ok=True)
+        total -= size
+        evicted.append(entry.stem)
+    return evicted
+
+# Fetch function for GranuleCache.open that streams a granule's .nc link straight into
+# the staging directory, instead of running the downloader
+def http_fetcher(url, session=None, chunk_size=1 << 20, timeout=60):
+    def fetch(directory):
+        target = Path(directory) / (Path(urlparse(url).path).name or 'granule.nc')
+        with (session or requests).get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(target, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+    return fetch
+
+# SHA-256 of a file's contents, remembered per inode and size so an unchanged
+# granule is only read once
+_checksums = {}
+
+def file_checksum(path):
+    stat = os.stat(path)
+    key = (str(path), stat.st_ino, stat.st_size)
+    if key not in _checksums:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _checksums[key] = digest.hexdigest()
+    return _checksums[key]
+
+# On-disk cache of downloaded PIXC granules, keyed by granule UR or concept ID.
+#
+# Each granule is stored once under the hash of its ID. Downloads run in a private
+# staging directory and are moved into place with an atomic rename, so a reader never
+# sees a partial file. Concurrent requests for the same granule wait on a per-entry
+# lock and share a single download. When the cache grows past max_bytes the least
+# recently used entries that are not in use are deleted.
+class GranuleCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = int(max_bytes)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entry_locks = {}
+        self._pins = {}
+
+    def key(self, granule_id):
+        return hashlib.sha256(granule_id.encode('utf-8')).hexdigest()
+
+    def path(self, granule_id):
+        return self.directory / f'{self.key(granule_id)}.nc'
+
+    def _entry_lock(self, key):
+        with self._lock:
+            return self._entry_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def open(self, granule_id, command):
+        # Yield the local path of a granule, running `command` to download it on a miss.
+        # `command` is an argument list; '{directory}' in any argument is replaced by the
+        # staging directory the downloader should write its .nc file to. It may instead
+        # be a function, called with the staging directory, such as http_fetcher(url), or
+        # None to only look the granule up, raising FileNotFoundError if it is not cached.
+        key = self.key(granule_id)
+        path = self.path(granule_id)
+
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            with self._entry_lock(key):
+                if path.exists():
+                    # Touch the entry so eviction sees it as recently used
+                    os.utime(path)
+                    metrics.cache_lookup('granule', True)
+                else:
+                    metrics.cache_lookup('granule', False)
+                    with metrics.span('download', granule=granule_id):
+                        self._download(granule_id, command, path)
+                    self._evict()
+            yield path
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    def _download(self, granule_id, command, path):
+        if command is None:
+            raise FileNotFoundError(f"Granule {granule_id} is not cached")
+        staging = self.staging()
+        try:
+            if callable(command):
+                command(staging)
+            else:
+                subprocess.run([arg.replace('{directory}', staging) for arg in command], check=True)
+
+            # Prefer the file named after the granule if the downloader fetched several
+            downloaded = sorted(Path(staging).rglob('*.nc'))
+            if not downloaded:
+                raise FileNotFoundError(f"Downloader produced no .nc file for granule {granule_id}")
+            named = [f for f in downloaded if f.stem == granule_id]
+            os.replace(named[0] if named else downloaded[0], path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def staging(self):
+        # Private scratch directory on the cache's filesystem, so files written there can
+        # be moved into the cache with add(); the caller removes it
+        return tempfile.mkdtemp(prefix='.staging-', dir=self.directory)
+
+    def add(self, granule_id, source, checksum=None):
+        # Move a complete file (e.g. an upload written under staging()) into the cache;
+        # its SHA-256, if already known, is remembered for file_checksum
+        key = self.key(granule_id)
+        path = self.path(granule_id)
+        with self._entry_lock(key):
+            os.replace(source, path)
+            if checksum:
+                stat = os.stat(path)
+                _checksums[(str(path), stat.st_ino, stat.st_size)] = checksum
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            evict_lru(self.directory, '*.nc', self.max_bytes, keep=self._pins)
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in self.directory.glob('*.nc'))
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Background jobs for long-running requests.
+#
+# Jobs run on a bounded thread pool. At most max_queue jobs may be queued or running
+# at once; beyond that submit raises JobQueueFull so the endpoint can answer 429.
+# A job submitted while an identical one (same key) is still in flight is not run
+# again: the caller gets the existing job back.
+
+class JobQueueFull(Exception):
+    pass
+
+def job_key(*parts):
+    # Stable hash of the job inputs; dicts are serialized with sorted keys
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.error = None
+        self.result = None
+        self.progress = None
+        self.errors = []
+        self.result_key = None
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def update(self, status):
+        # Progress can arrive from worker processes after the job has finished (see
+        # ProcessingPool); it must not overwrite the final status, set by finish
+        with self._lock:
+            if not self.done:
+                self.status = status
+
+    def finish(self, status, error=None):
+        with self._lock:
+            self.error = error
+            self.finished = time.time()
+            self.status = status
+
+    def report(self, progress):
+        # Per-stage counts of a multi-granule job, e.g. from pipeline.run_pipeline
+        self.progress = progress
+
+    def add_error(self, error):
+        # One failed item of a multi-granule job that still goes on, e.g. {'granule': ..., 'error': ...}
+        with self._lock:
+            self.errors.append(error)
+
+    def attach(self, result_key):
+        # Result-cache key of the table behind the job's result, for views of it (map tiles)
+        self.result_key = result_key
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'progress': self.progress,
+            'errors': list(self.errors),
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+class JobManager:
+    def __init__(self, max_workers=2, max_queue=16, max_finished=256):
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+
+    def submit(self, key, run, *args):
+        # run(job, *args) does the work, reporting progress through job.update(status),
+        # and returns the job result
+        with self._lock:
+            existing = self._in_flight.get(key)
+            if existing is not None:
+                return existing
+            if len(self._in_flight) >= self.max_queue:
+                raise JobQueueFull(f"{len(self._in_flight)} jobs already queued or running")
+
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+            self._prune()
+        self._executor.submit(self._run, job, run, *args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, run, *args):
+        try:
+            job.result = run(job, *args)
+            job.finish('done')
+        except Exception as e:
+            job.finish('failed', str(e))
+        finally:
+            with self._lock:
+                self._in_flight.pop(job.key, None)
+
+    def _prune(self):
+        # Forget the oldest finished jobs once more than max_finished are kept
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+
+# Stage instrumentation, Prometheus metrics and an opt-in sampling profiler.
+#
+# `with span('clip', rows_in=n) as s:` times a stage. When it ends, its wall time,
+# thread CPU time, rows in and out (set s.rows_out) and RSS delta are logged as one
+# JSON line on the 'metrics' logger, and recorded in the process's registry, which
+# GET /metrics renders in the Prometheus text format. Worker processes send their
+# spans to the parent with set_span_sink, so the web process's registry counts them
+# too. Each gunicorn worker keeps its own registry, so a scrape sees the worker that
+# answered it.
+#
+# With PROFILE_SLOW_SECONDS set, requests and pool tasks are sampled every
+# PROFILE_INTERVAL seconds, and the stacks of any that take longer than the threshold
+# are saved to PROFILE_DIR in the collapsed format flamegraph.pl and speedscope read.
+
+logger = logging.getLogger('metrics')
+
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 0)) or None
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def current_rss():
+    # Resident set size of this process in bytes, None where /proc is unavailable
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class Registry:
+    # Counters and histograms keyed by (name, labels), rendered as Prometheus text
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._counters[(name, tuple(labels))] += value
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        with self._lock:
+            key = (name, tuple(labels))
+            if key not in self._histograms:
+                self._histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            histogram = self._histograms[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[1][i] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (buckets, list(counts), total, count)
+                          for key, (buckets, counts, total, count) in self._histograms.items()}
+
+        series = defaultdict(list)
+        for (name, labels), value in sorted(counters.items()):
+            series[name].append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            for bound, bucket_count in zip(buckets, counts):
+                series[name].append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {bucket_count}')
+            series[name].append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            series[name].append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+            series[name].append(f'{name}_count{format_labels(labels)} {count}')
+
+        # Hit ratio of each cache, derived from the lookup counters
+        hits, lookups = Counter(), Counter()
+        for (name, labels), value in counters.items():
+            if name == 'pixc_cache_lookups_total':
+                labels = dict(labels)
+                lookups[labels['cache']] += value
+                hits[labels['cache']] += value if labels['result'] == 'hit' else 0
+        for cache in sorted(lookups):
+            series['pixc_cache_hit_ratio'].append(
+                f'pixc_cache_hit_ratio{format_labels((("cache", cache),))} {format_value(hits[cache] / lookups[cache])}')
+
+        # Share of the remote granules' bytes actually fetched
+        file_bytes = counters.get(('pixc_remote_file_bytes_total', ()))
+        if file_bytes:
+            series['pixc_remote_fetched_ratio'].append(
+                f"pixc_remote_fetched_ratio {format_value(counters[('pixc_remote_bytes_transferred_total', ())] / file_bytes)}")
+
+        lines = []
+        for name in sorted(series):
+            kind, text = self._help.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(series[name])
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+registry = Registry()
+registry.describe('pixc_stage_seconds', 'histogram', 'Wall time of each pipeline stage')
+registry.describe('pixc_stage_cpu_seconds_total', 'counter', 'CPU time of the thread running each stage')
+registry.describe('pixc_stage_rows_in_total', 'counter', 'Rows entering each stage')
+registry.describe('pixc_stage_rows_out_total', 'counter', 'Rows leaving each stage')
+registry.describe('pixc_stage_errors_total', 'counter', 'Stages that raised')
+registry.describe('pixc_http_request_duration_seconds', 'histogram', 'Latency of HTTP requests')
+registry.describe('pixc_cache_lookups_total', 'counter', 'Cache lookups by result (hit or miss)')
+registry.describe('pixc_cache_hit_ratio', 'gauge', 'Share of cache lookups that hit')
+registry.describe('pixc_remote_bytes_transferred_total', 'counter', 'Bytes fetched from remote granules')
+registry.describe('pixc_remote_file_bytes_total', 'counter', 'Size of the remote granules read')
+registry.describe('pixc_remote_requests_total', 'counter', 'Range requests made for remote granules')
+registry.describe('pixc_remote_fetched_ratio', 'gauge', 'Share of the remote granules\' bytes fetched')
+
+class Span:
+    def __init__(self, name, rows_in=None, **fields):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.fields = fields
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        self._rss = current_rss()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        rss = current_rss()
+        record = {
+            'span': self.name,
+            'seconds': time.perf_counter() - self._wall,
+            'cpu_seconds': time.thread_time() - self._cpu,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rss_delta_bytes': rss - self._rss if rss is not None and self._rss is not None else None,
+            'pid': os.getpid(),
+            **self.fields,
+        }
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        _span_sink(record)
+        return False
+
+def span(name, rows_in=None, **fields):
+    # Extra keyword fields (e.g. granule=...) go to the log line only
+    return Span(name, rows_in, **fields)
+
+def record_span(record):
+    # Log a finished span and count it in this process's registry
+    logger.info(json.dumps(record, default=str))
+    labels = (('stage', record['span']),)
+    registry.observe('pixc_stage_seconds', record['seconds'], labels)
+    registry.inc('pixc_stage_cpu_seconds_total', labels, record['cpu_seconds'])
+    if record.get('rows_in') is not None:
+        registry.inc('pixc_stage_rows_in_total', labels, record['rows_in'])
+    if record.get('rows_out') is not None:
+        registry.inc('pixc_stage_rows_out_total', labels, record['rows_out'])
+    if record.get('error'):
+        registry.inc('pixc_stage_errors_total', labels)
+    if record.get('bytes_transferred') is not None:
+        # Granules read over HTTP range requests (see remote_granule)
+        registry.inc('pixc_remote_bytes_transferred_total', (), record['bytes_transferred'])
+        registry.inc('pixc_remote_file_bytes_total', (), record['file_size'])
+        registry.inc('pixc_remote_requests_total', (), record['requests'])
+
+_span_sink = record_span
+
+def set_span_sink(sink):
+    # Send finished spans to sink (a function of the record) instead of recording them here
+    global _span_sink
+    _span_sink = sink
+
+def record_request(method, endpoint, status, seconds):
+    logger.info(json.dumps({'request': endpoint, 'method': method, 'status': status, 'seconds': seconds}))
+    registry.observe('pixc_http_request_duration_seconds', seconds,
+                     (('method', method), ('endpoint', endpoint), ('status', str(status))))
+
+def cache_lookup(cache, hit):
+    registry.inc('pixc_cache_lookups_total', (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+def render():
+    return registry.render()
+
+class Sampler:
+    # Samples the stack of one thread from a background thread every `interval` seconds
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+def collapse_stack(frame):
+    # 'outermost;...;innermost' frame names, as in collapsed-stack files
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class Profiler:
+    # Samples the calling thread between start() and stop() (or as a context manager) and
+    # saves the stacks if it took longer than threshold; does nothing without a threshold
+    def __init__(self, name, threshold=PROFILE_SLOW_SECONDS, directory=PROFILE_DIR):
+        self.name = name
+        self.threshold = threshold
+        self.directory = directory
+        self.path = None
+        self._sampler = None
+
+    def start(self):
+        if self.threshold:
+            self._start = time.perf_counter()
+            self._sampler = Sampler(threading.get_ident())
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        if self._sampler is None:
+            return None
+        stacks = self._sampler.stop()
+        self._sampler = None
+        seconds = time.perf_counter() - self._start
+        if seconds >= self.threshold and stacks:
+            self.path = save_profile(self.directory, self.name, stacks)
+            logger.info(json.dumps({'profile': self.path, 'name': self.name, 'seconds': seconds}))
+        return self.path
+
+    __enter__ = start
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+def save_profile(directory, name, stacks):
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')[:80]
+    path = os.path.join(directory, f'{stamp}-{os.getpid()}-{slug}.folded')
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    return path
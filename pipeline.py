@@ -0,0 +1,108 @@
+import queue
+import threading
+
+
+# Producer/consumer pipeline overlapping granule downloads with their processing.
+#
+# download_workers threads fetch granules and put each local file on a bounded queue
+# as soon as it lands; process_workers threads take files off the queue and process
+# them. When the queue is full the downloaders wait, so at most queue_depth fetched
+# granules sit waiting for a processor. Results are yielded in completion order, a
+# failed granule yielding its exception, and the per-stage counts are reported after
+# every change.
+
+_DONE = object()
+
+def run_pipeline(items, fetch, process, download_workers=4, process_workers=2, queue_depth=None, report=None):
+    # fetch(item) returns a context manager yielding the item's local path, which is
+    # exited once the item has been processed; process(item, path) returns its result.
+    # report, if given, is called with a dict of counts: total, downloading, downloaded,
+    # processing, processed and failed.
+    items = list(items)
+    todo = queue.Queue()
+    for item in items:
+        todo.put(item)
+    landed = queue.Queue(queue_depth or process_workers)
+    results = queue.Queue()
+    stop = threading.Event()
+
+    counts = {'total': len(items), 'downloading': 0, 'downloaded': 0, 'processing': 0, 'processed': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+
+    def count(**changes):
+        with counts_lock:
+            for stage, change in changes.items():
+                counts[stage] += change
+            snapshot = dict(counts)
+        if report:
+            report(snapshot)
+
+    def download():
+        while not stop.is_set():
+            try:
+                item = todo.get_nowait()
+            except queue.Empty:
+                return
+            count(downloading=1)
+            try:
+                context = fetch(item)
+                path = context.__enter__()
+            except Exception as e:
+                count(downloading=-1, failed=1)
+                results.put((item, e))
+                continue
+            count(downloading=-1, downloaded=1)
+
+            # Wait for a free processor slot, giving up if the pipeline is stopped
+            while True:
+                if stop.is_set():
+                    context.__exit__(None, None, None)
+                    return
+                try:
+                    landed.put((item, context, path), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def process_landed():
+        while True:
+            entry = landed.get()
+            if entry is _DONE:
+                return
+            item, context, path = entry
+            try:
+                if stop.is_set():
+                    continue
+                count(processing=1)
+                try:
+                    result = process(item, path)
+                    count(processing=-1, processed=1)
+                except Exception as e:
+                    result = e
+                    count(processing=-1, failed=1)
+                results.put((item, result))
+            finally:
+                context.__exit__(None, None, None)
+
+    downloaders = [threading.Thread(target=download, daemon=True) for _ in range(max(1, min(download_workers, len(items))))]
+    processors = [threading.Thread(target=process_landed, daemon=True) for _ in range(max(1, process_workers))]
+
+    def close():
+        # Once every download has landed, tell the processors there is nothing more coming
+        for thread in downloaders:
+            thread.join()
+        for _ in processors:
+            landed.put(_DONE)
+
+    closer = threading.Thread(target=close, daemon=True)
+    for thread in downloaders + processors + [closer]:
+        thread.start()
+
+    try:
+        for _ in items:
+            yield results.get()
+    finally:
+        stop.set()
+        closer.join()
+        for thread in processors:
+            thread.join()
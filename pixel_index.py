@@ -0,0 +1,151 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from granule_cache import file_checksum
+from projection import to_utm
+
+
+# Build-once spatial index of the pixels of a PIXC granule, for repeated reach queries.
+#
+# The pixels are projected to the granule's UTM zone, bucketed into square grid cells
+# and written sorted by cell, one .npy file per column, next to a table of where each
+# occupied cell starts. The index lives in a directory named after the granule's
+# SHA-256, so a changed granule gets a new index, and meta.json records INDEX_VERSION
+# so an index written by older code is rebuilt. Queries memory-map the columns and
+# read only the rows of the cells that intersect the requested box.
+
+INDEX_VERSION = 1
+DEFAULT_CELL_SIZE = 1000.0
+
+def fill_masked(values):
+    # Masked values become NaN; integer variables with masked values become float64,
+    # as they do when process_data builds its DataFrame
+    if np.ma.is_masked(values):
+        if values.dtype.kind in 'iu':
+            values = values.astype('float64')
+        return np.ma.filled(values, np.nan)
+    return np.ma.getdata(values)
+
+def build_index(netcdf_path, directory, variables, utm_epsg, cell_size=DEFAULT_CELL_SIZE, checksum=None):
+    # utm_epsg(min_lat, max_lat, min_lon, max_lon) picks the projection for the granule
+    from netCDF4 import Dataset
+    checksum = checksum or file_checksum(netcdf_path)
+    target = Path(directory) / checksum
+
+    with Dataset(netcdf_path, 'r') as nc:
+        pixel_cloud = nc.groups['pixel_cloud']
+        columns = {name: fill_masked(pixel_cloud.variables[name][:]) for name in variables}
+
+    latitude, longitude = columns['latitude'], columns['longitude']
+    valid = np.isfinite(latitude) & np.isfinite(longitude)
+    epsg_code = utm_epsg(np.nanmin(latitude), np.nanmax(latitude), np.nanmin(longitude), np.nanmax(longitude))
+    # longitude[valid] and latitude[valid] are fresh copies, so they can be projected in place
+    x, y = to_utm(longitude[valid], latitude[valid], epsg_code, inplace=True)
+
+    origin_x, origin_y = np.floor(x.min() / cell_size) * cell_size, np.floor(y.min() / cell_size) * cell_size
+    ix = ((x - origin_x) // cell_size).astype(np.int64)
+    iy = ((y - origin_y) // cell_size).astype(np.int64)
+    nx = int(ix.max()) + 1 if len(ix) else 1
+    cell = iy * nx + ix
+    order = np.argsort(cell, kind='stable')
+    cells, starts = np.unique(cell[order], return_index=True)
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+    try:
+        np.save(os.path.join(staging, 'x.npy'), x[order])
+        np.save(os.path.join(staging, 'y.npy'), y[order])
+        np.save(os.path.join(staging, 'row.npy'), np.flatnonzero(valid)[order])
+        for name, values in columns.items():
+            np.save(os.path.join(staging, f'{name}.npy'), values[valid][order])
+        np.save(os.path.join(staging, 'cells.npy'), cells)
+        np.save(os.path.join(staging, 'starts.npy'), np.append(starts, len(order)))
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'checksum': checksum,
+                'epsg_code': epsg_code,
+                'origin': [origin_x, origin_y],
+                'cell_size': cell_size,
+                'nx': nx,
+                'rows': int(len(order)),
+                'variables': list(variables),
+            }, f)
+
+        if target.exists():
+            shutil.rmtree(target, ignore_errors=True)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another process finished the same index first
+            pass
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return target
+
+class PixelIndex:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / 'meta.json') as f:
+            self.meta = json.load(f)
+        self.epsg_code = self.meta['epsg_code']
+        self.cell_size = self.meta['cell_size']
+        self.origin_x, self.origin_y = self.meta['origin']
+        self.nx = self.meta['nx']
+        self.cells = np.load(self.path / 'cells.npy')
+        self.starts = np.load(self.path / 'starts.npy')
+        self._columns = {}
+
+    def column(self, name):
+        # Memory-mapped, so only the pages of the rows that are read get loaded
+        if name not in self._columns:
+            self._columns[name] = np.load(self.path / f'{name}.npy', mmap_mode='r')
+        return self._columns[name]
+
+    def row_ranges(self, min_x, min_y, max_x, max_y):
+        # (start, stop) row ranges of the occupied cells intersecting the box
+        ix0 = max(int((min_x - self.origin_x) // self.cell_size), 0)
+        ix1 = min(int((max_x - self.origin_x) // self.cell_size), self.nx - 1)
+        iy0 = max(int((min_y - self.origin_y) // self.cell_size), 0)
+        iy1 = int((max_y - self.origin_y) // self.cell_size)
+        if ix1 < ix0 or iy1 < iy0:
+            return []
+
+        ranges = []
+        for iy in range(iy0, iy1 + 1):
+            # Cells of one grid row are stored next to each other
+            first = np.searchsorted(self.cells, iy * self.nx + ix0, side='left')
+            last = np.searchsorted(self.cells, iy * self.nx + ix1, side='right')
+            if first < last:
+                ranges.append((int(self.starts[first]), int(self.starts[last])))
+        return ranges
+
+    def read(self, min_x, min_y, max_x, max_y, variables):
+        # Columns x, y, row (the pixel's position in the granule) and the given variables
+        # for the pixels in the cells intersecting the box, in granule order
+        ranges = self.row_ranges(min_x, min_y, max_x, max_y)
+        data = {}
+        for name in ['row', 'x', 'y'] + list(variables):
+            column = self.column(name)
+            data[name] = (np.concatenate([column[start:stop] for start, stop in ranges])
+                          if ranges else np.empty(0, dtype=column.dtype))
+        order = np.argsort(data['row'], kind='stable')
+        return {name: values[order] for name, values in data.items()}
+
+def open_index(netcdf_path, directory, variables, utm_epsg, cell_size=DEFAULT_CELL_SIZE):
+    # The granule's index, built first if it is missing or was written by another INDEX_VERSION
+    checksum = file_checksum(netcdf_path)
+    path = Path(directory) / checksum
+    meta_path = path / 'meta.json'
+    if meta_path.exists():
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('version') == INDEX_VERSION and set(variables) <= set(meta.get('variables', [])):
+            return PixelIndex(path)
+    build_index(netcdf_path, directory, variables, utm_epsg, cell_size, checksum)
+    return PixelIndex(path)
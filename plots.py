@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from granule_cache import evict_lru
+
+
+# Rendering of the water surface elevation against chainage plot.
+#
+# Figures are built with matplotlib's object-oriented API on their own Agg canvas,
+# never through pyplot, so no figure is registered in pyplot's global state and each
+# one is freed as soon as the PNG is written. 'scatter' draws every pixel; 'density'
+# bins the pixels into a 2D histogram of chainage against height, so drawing costs the
+# same however many pixels there are. Rendered PNGs are kept in a PlotCache keyed by
+# the result-cache key and the plot parameters. matplotlib is imported on the first
+# render rather than with the server, as it takes longer to import than the rest.
+
+PLOT_MODES = ('scatter', 'density')
+FIGSIZE = (15, 8)
+DPI = 100
+DENSITY_BINS = (400, 200)
+
+def plot_key(result_key, mode='scatter', figsize=FIGSIZE, dpi=DPI, bins=DENSITY_BINS):
+    parts = [result_key, mode, list(figsize), dpi, list(bins) if mode == 'density' else None]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def render_plot(df, mode='scatter', figsize=FIGSIZE, dpi=DPI, bins=DENSITY_BINS):
+    # PNG bytes of the plot of a process_data result
+    if mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot mode: {mode}")
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.colors import LogNorm
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    # Apply filter to keep points where classification is greater than 2 and not 5
+    df_filtered = df[(df['classification'] > 2) & (df['classification'] != 5)]
+
+    if mode == 'scatter':
+        sc = ax.scatter(df_filtered['cumulative_distance'], df_filtered['height'],
+                        c=df_filtered['geolocation_qual'], cmap='viridis', zorder=2, label='SWOT WSE data')
+        ax.legend()
+        colorbar_label = 'Coherent Power'
+    else:
+        distance = df_filtered['cumulative_distance'].to_numpy(dtype=float)
+        height = df_filtered['height'].to_numpy(dtype=float)
+        finite = np.isfinite(distance) & np.isfinite(height)
+        counts, distance_edges, height_edges = np.histogram2d(distance[finite], height[finite], bins=bins)
+        # Drawn as one image, empty bins left blank
+        sc = ax.imshow(np.ma.masked_equal(counts.T, 0), origin='lower', aspect='auto', interpolation='nearest',
+                       extent=(distance_edges[0], distance_edges[-1], height_edges[0], height_edges[-1]),
+                       cmap='viridis', norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)))
+        colorbar_label = 'Pixels per bin'
+
+    ax.set_title('Water Surface Elevation vs Distance for selected reach')
+    ax.set_xlabel('Distance Downstream')
+    ax.set_ylabel('WSE (m)')
+
+    # Add color bar
+    cbar = fig.colorbar(sc, ax=ax)
+    cbar.set_label(colorbar_label)
+
+    img = BytesIO()
+    fig.savefig(img, format='png')
+    return img.getvalue()
+
+class PlotCache:
+    # On-disk cache of rendered PNGs, with atomic writes and LRU eviction past max_bytes;
+    # lookups are counted in the metrics under name
+    name = 'plot'
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = int(max_bytes)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return self.directory / f'{key}.png'
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            png = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            metrics.cache_lookup(self.name, False)
+            return None
+        metrics.cache_lookup(self.name, True)
+        return png
+
+    def put(self, key, png):
+        fd, temp_path = tempfile.mkstemp(prefix='.staging-', suffix='.png', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(png)
+            os.replace(temp_path, self.path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        with self._lock:
+            evict_lru(self.directory, '*.png', self.max_bytes, keep={key})
@@ -1,134 +1,129 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import geopandas as gpd
-import pandas as pd
-import xarray as xr
-from shapely.geometry import MultiPoint, LineString
-from netCDF4 import Dataset
-import numpy as np
-from scipy.spatial import cKDTree
-import tempfile
+from flask import Blueprint, Response, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+import netCDF4
+import hashlib
+import json
+import shutil
+from io import BytesIO
+import external_processor
+from result_formats import choose_format, encode_result
 import os
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-def process_data(netcdf_path, geojson_line, buffer_distance, spacing):
-    # Load NetCDF file
-    nc = Dataset(netcdf_path, 'r')
-    pixel_cloud = nc.groups['pixel_cloud']
-
-    # Extract variables
-    latitude = pixel_cloud.variables['latitude'][:]
-    longitude = pixel_cloud.variables['longitude'][:]
-    height = pixel_cloud.variables['height'][:]
-    water_frac = pixel_cloud.variables['water_frac'][:]
-    coherent_power = pixel_cloud.variables['coherent_power'][:]
-    classification = pixel_cloud.variables['classification'][:]
-    missed_detection_rate = pixel_cloud.variables['missed_detection_rate'][:]
-    geolocation_qual = pixel_cloud.variables['geolocation_qual'][:]
-    nc.close()
-
-    # Create a pandas DataFrame
-    df_PIXC = pd.DataFrame({
-        'latitude': latitude,
-        'longitude': longitude,
-        'height': height,
-        'water_frac': water_frac,
-        'coherent_power': coherent_power,
-        'classification': classification,
-        'missed_detection_rate': missed_detection_rate,
-        'geolocation_qual': geolocation_qual
-    })
-
-    # Convert the DataFrame to an xarray Dataset
-    ds = xr.Dataset.from_dataframe(df_PIXC)
-
-    # Convert GeoJSON line to GeoDataFrame
-    geojson_gdf = gpd.GeoDataFrame.from_features(geojson_line['features'])
-    river = geojson_gdf.set_crs("EPSG:4326")
-
-    # Buffer the line
-    river_buffered = river.buffer(buffer_distance, cap_style='flat')
-    river_buffered_gdf = gpd.GeoDataFrame(geometry=river_buffered, crs=river.crs)
-
-    # Interpolate points along the line
-    def interpolate_points(line, distance):
-        num_points = int(line.length / distance)
-        return MultiPoint([line.interpolate(i * distance) for i in range(num_points + 1)])
-
-    # Apply interpolation
-    points_gdf = river.geometry.apply(lambda x: interpolate_points(x, spacing))
-    points_gdf = points_gdf.explode(index_parts=True).reset_index(drop=True)
-    river_points = gpd.GeoDataFrame(geometry=points_gdf)
-
-    # Calculate cumulative distance
-    def calculate_cumulative_distance(gdf):
-        gdf['prev_geometry'] = gdf['geometry'].shift()
-        gdf['distance_to_prev'] = gdf.apply(lambda row: row['geometry'].distance(row['prev_geometry']) if pd.notna(row['prev_geometry']) else 0, axis=1)
-        gdf['cumulative_distance'] = gdf['distance_to_prev'].cumsum()
-        return gdf
-
-    river = calculate_cumulative_distance(river_points)
-    river.reset_index(drop=True, inplace=True)
-
-    river_cum_dis = river['cumulative_distance'].values
-
-    river_buffered_gdf = river_buffered_gdf.to_crs('epsg:4326')
-
-    # Convert 'ds' to GeoDataFrame and clip to buffer
-    ds_gdf = gpd.GeoDataFrame({
-        'latitude': latitude,
-        'longitude': longitude,
-        'height': height,
-        'water_frac': water_frac,
-        'coherent_power': coherent_power,
-        'classification': classification,
-        'missed_detection_rate': missed_detection_rate,
-        'geolocation_qual': geolocation_qual
-    }, geometry=gpd.points_from_xy(df_PIXC['longitude'], df_PIXC['latitude']), crs="EPSG:4326")
-    ds_clipped = gpd.sjoin(ds_gdf, river_buffered_gdf, how='inner', predicate='within')
-
-    # Find nearest river point to each ds point
-    river = river.to_crs('EPSG:32633')  # You may need to dynamically determine the EPSG code
-    ds_coords_utm = np.column_stack((ds_clipped.geometry.x, ds_clipped.geometry.y))
-    river_coords_utm = np.column_stack((river.geometry.x, river.geometry.y))
-    tree_river = cKDTree(river_coords_utm)
-
-    distances, indices = tree_river.query(ds_coords_utm)
-    nearest_GNSS_dist = river_cum_dis[indices]
-    ds_clipped['nearest_GNSS_dist'] = nearest_GNSS_dist
-    ds_clipped['nearest_index'] = indices
-    ds_clipped['distance_to_nearest'] = distances
-
-    # Merge DataFrames
-    columns_to_keep = [col for col in ds_clipped.columns if col not in river.columns or col == 'nearest_index']
-    ds_clipped_subset = ds_clipped[columns_to_keep]
-    merged_df = river.merge(ds_clipped_subset, left_index=True, right_on='nearest_index', how='left')
-
-    return merged_df
-
-@app.route('/process', methods=['POST'])
+# Endpoints are mounted on the application built by app.create_app
+bp = Blueprint('process_nc_file', __name__)
+
+# Uploads are streamed in chunks, and hashed as they arrive, into a scratch directory of
+# the granule cache rather than buffered whole first. Uploads of up to UPLOAD_MEMORY_BYTES
+# stay in memory and are opened with Dataset(memory=...) where netCDF4 supports it.
+# Processed uploads are kept in the granule cache as 'upload:<sha256>', which is returned
+# in the X-Granule-Id header and can be sent as granule_id instead of the file next time.
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 4 * 1024 ** 3))
+UPLOAD_MEMORY_BYTES = int(os.environ.get('UPLOAD_MEMORY_BYTES', 64 * 1024 ** 2)) if netCDF4.__has_nc_open_mem__ else 0
+
+class UploadSink:
+    # Write target for the multipart parser that hashes and counts the bytes on the way through
+    def __init__(self, target, max_bytes):
+        self.target = target
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Upload larger than {self.max_bytes} bytes")
+        self.sha256.update(data)
+        return self.target.write(data)
+
+    def seek(self, *args):
+        return self.target.seek(*args)
+
+    def close(self):
+        self.target.close()
+
+def process_data(netcdf_path, geojson_line, buffer_distance, spacing, memory=None):
+    # memory, if given, holds the granule's bytes and netcdf_path only names it. The
+    # pixels are clipped and matched by external_processor.process_data, as for
+    # /download_and_process, reading only the pixels near the line; the stations come
+    # back as UTM Points.
+    return external_processor.process_data(netcdf_path, geojson_line, buffer_distance, spacing, memory=memory,
+                                           geometry=True)
+
+@bp.route('/process', methods=['POST'])
 def process_request():
-    netcdf_file = request.files.get('netcdf')
-    geojson_line = request.form.get('geojson')
-    buffer_distance = float(request.form.get('buffer_distance'))
-    spacing = float(request.form.get('spacing'))
+    # Multipart form with geojson, buffer_distance, spacing and either the granule as the
+    # 'netcdf' file or the ID of a cached granule as granule_id
+    from proxy_server import granule_cache
 
-    # Save NetCDF file temporarily
-    temp_nc_file = tempfile.NamedTemporaryFile(delete=False)
-    netcdf_file.save(temp_nc_file.name)
+    scratch = granule_cache.staging()
+    sinks = []
 
-    # Process the data
-    try:
-        geojson_data = eval(geojson_line)  # Use JSON deserialization instead of eval in production
-        result = process_data(temp_nc_file.name, geojson_data, buffer_distance, spacing)
-        os.unlink(temp_nc_file.name)  # Clean up temp file
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_BYTES:
+            target = BytesIO()
+        else:
+            target = open(os.path.join(scratch, f'upload-{len(sinks)}.nc'), 'w+b')
+        sinks.append(UploadSink(target, UPLOAD_MAX_BYTES))
+        return sinks[-1]
 
-        # Return result as JSON
-        return jsonify(result.to_json()), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    try:
+        try:
+            _, form, files = parse_form_data(request.environ, stream_factory=stream_factory,
+                                             max_content_length=UPLOAD_MAX_BYTES)
+        except RequestEntityTooLarge:
+            return jsonify({'error': f"Upload larger than {UPLOAD_MAX_BYTES} bytes"}), 413
+
+        try:
+            geojson_data = json.loads(form.get('geojson'))
+            buffer_distance = float(form.get('buffer_distance'))
+            spacing = float(form.get('spacing'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'geojson must be JSON and buffer_distance and spacing numbers'}), 400
+
+        granule_id = form.get('granule_id')
+        upload = files.get('netcdf')
+        if not granule_id and upload is None:
+            return jsonify({'error': 'Send the granule as netcdf or the ID of a cached granule as granule_id'}), 400
+
+        # Process the data
+        try:
+            if granule_id:
+                try:
+                    with granule_cache.open(granule_id, None) as path:
+                        result = process_data(str(path), geojson_data, buffer_distance, spacing)
+                except FileNotFoundError as e:
+                    return jsonify({'error': str(e)}), 404
+            else:
+                sink = upload.stream
+                checksum = sink.sha256.hexdigest()
+                granule_id = f'upload:{checksum}'
+                if isinstance(sink.target, BytesIO):
+                    result = process_data(granule_id, geojson_data, buffer_distance, spacing,
+                                          memory=sink.target.getvalue())
+                    path = os.path.join(scratch, 'upload.nc')
+                    with open(path, 'wb') as f:
+                        f.write(sink.target.getbuffer())
+                else:
+                    sink.close()
+                    path = sink.target.name
+                    result = process_data(path, geojson_data, buffer_distance, spacing)
+                granule_cache.add(granule_id, path, checksum)
+
+            # Return the result in the format asked for by ?format= or the Accept header, JSON by default
+            fmt = choose_format(request.accept_mimetypes, request.args.get('format') or form.get('format'))
+            payload, mimetype = encode_result(result, fmt)
+            response = Response(payload, mimetype=mimetype)
+            response.headers['X-Granule-Id'] = granule_id
+            return response, 200
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    finally:
+        # The scratch directory goes whatever happened
+        for sink in sinks:
+            sink.close()
+        shutil.rmtree(scratch, ignore_errors=True)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    from app import create_app
+    create_app().run(debug=True)
@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import metrics
+
+
+# Warm pool of worker processes running external_processor.process_data in-process.
+#
+# Each worker imports the geo stack once when it starts, so a request pays only for
+# its own processing. Results travel back as a dict of NumPy column arrays, which
+# pickle as raw buffers, instead of being encoded to JSON text and parsed again.
+# Stage names reported by process_data are sent back over a shared queue and handed
+# to the progress callback given for that task. The workers' metrics spans travel back
+# over the same queue and are recorded in the parent (see metrics).
+
+# Stream granules in batches of this many pixels to bound worker memory (0 reads them whole)
+MAX_BATCH_ROWS = int(os.environ.get('MAX_BATCH_ROWS', 0)) or None
+
+# Read granules through per-granule spatial indexes kept in this directory (unset: off)
+PIXEL_INDEX_DIR = os.environ.get('PIXEL_INDEX_DIR') or None
+
+_progress_queue = None
+
+def _preload(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+    metrics.set_span_sink(lambda record: progress_queue.put(('span', record)))
+    # Pulls in pandas, shapely, scipy and pyproj
+    import external_processor  # noqa: F401
+
+def _noop():
+    return os.getpid()
+
+def to_columns(df):
+    return {col: df[col].to_numpy() for col in df.columns}
+
+def from_columns(columns):
+    return pd.DataFrame(columns)
+
+def _process(task_id, netcdf_path, geojson_path, buffer_distance, spacing, clip_mode):
+    from external_processor import process_data
+    progress = (lambda stage: _progress_queue.put(('progress', task_id, stage))) if task_id else None
+    with metrics.Profiler(f'process_data {os.path.basename(netcdf_path)}'), \
+            metrics.span('process_data', granule=netcdf_path):
+        return to_columns(process_data(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode, progress,
+                                       max_batch_rows=MAX_BATCH_ROWS, index_dir=PIXEL_INDEX_DIR))
+
+class ProcessingPool:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self._progress_queue = multiprocessing.Queue()
+        self._progress_callbacks = {}
+        self._executor = ProcessPoolExecutor(self.max_workers, initializer=_preload, initargs=(self._progress_queue,))
+        self._listener = threading.Thread(target=self._dispatch_progress, daemon=True)
+        self._listener.start()
+
+    def _dispatch_progress(self):
+        while True:
+            message = self._progress_queue.get()
+            if message is None:
+                return
+            if message[0] == 'span':
+                metrics.record_span(message[1])
+                continue
+            _, task_id, stage = message
+            callback = self._progress_callbacks.get(task_id)
+            if callback:
+                callback(stage)
+
+    def warm(self):
+        # Start every worker now rather than on the first requests
+        for future in [self._executor.submit(_noop) for _ in range(self.max_workers)]:
+            future.result()
+
+    def run(self, fn, *args):
+        # Run any picklable top-level function in a warm worker
+        return self._executor.submit(fn, *args)
+
+    def submit(self, netcdf_path, geojson_path, buffer_distance, spacing, clip_mode='within', progress=None):
+        task_id = None
+        if progress:
+            task_id = uuid.uuid4().hex
+            self._progress_callbacks[task_id] = progress
+        future = self._executor.submit(_process, task_id, str(netcdf_path), str(geojson_path),
+                                       float(buffer_distance), float(spacing), clip_mode)
+        if task_id:
+            future.add_done_callback(lambda _: self._progress_callbacks.pop(task_id, None))
+        return future
+
+    def process(self, netcdf_path, geojson_path, buffer_distance, spacing, clip_mode='within', progress=None):
+        return from_columns(self.submit(netcdf_path, geojson_path, buffer_distance, spacing, clip_mode, progress).result())
+
+    def shutdown(self):
+        self._executor.shutdown()
+        self._progress_queue.put(None)
+        self._listener.join()
@@ -0,0 +1,48 @@
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+
+# Projection of lon/lat data to UTM.
+#
+# The zone is picked once per job from the centre of the data's extent, and everything
+# in the job (centerline, buffer, pixels) is projected to it, including a reach that
+# crosses into the next zone. EPSG codes are computed arithmetically (WGS 84 / UTM north
+# is 326zz, south 327zz), so picking a zone needs no CRS object and works on arrays.
+# Transformers are built once per (source, target) pair and kept in an LRU cache, and
+# coordinates are transformed as raw NumPy arrays rather than as shapely geometries.
+
+def utm_epsg(lat, lon):
+    # EPSG code of the UTM zone holding each (lat, lon); scalars give an int
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    zone = np.clip(((lon + 180) // 6).astype(int) + 1, 1, 60)
+    epsg = np.where(lat >= 0, 32600, 32700) + zone
+    return int(epsg) if epsg.ndim == 0 else epsg
+
+def extent_epsg(min_lat, max_lat, min_lon, max_lon):
+    # The zone of the centre of a bounding box
+    return utm_epsg((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+
+@lru_cache(maxsize=32)
+def get_transformer(source, target):
+    return Transformer.from_crs(source, target, always_xy=True)
+
+def to_utm(lon, lat, epsg_code, inplace=False):
+    # Project lon/lat arrays to (x, y). With inplace=True, float64 arrays that own their
+    # data are overwritten with x and y instead of being copied.
+    transformer = get_transformer('EPSG:4326', epsg_code)
+    lon, lat = np.ma.getdata(lon), np.ma.getdata(lat)
+    if inplace and all(a.dtype == np.float64 and a.flags.writeable and a.flags.c_contiguous for a in (lon, lat)):
+        transformer.transform(lon, lat, inplace=True)
+        return lon, lat
+    return transformer.transform(lon, lat)
+
+def from_utm(x, y, epsg_code):
+    return get_transformer(epsg_code, 'EPSG:4326').transform(x, y)
+
+def project_geometries(geometries, source, target):
+    # Reproject shapely geometries by transforming their coordinate arrays directly
+    transformer = get_transformer(source, target)
+    return shapely.transform(np.asarray(geometries), lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])))
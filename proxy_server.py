@@ -1,53 +1,88 @@
-from flask import Flask, request, jsonify, send_file
-from flask_cors import CORS
-import requests
+from flask import Blueprint, request, jsonify, send_file
 import os
+import json
+import shlex
 import tempfile
-import subprocess
-from netCDF4 import Dataset
+import threading
 from pathlib import Path
-import geopandas as gpd
-import sys
+from contextlib import nullcontext
+from urllib.parse import urlparse
 import pandas as pd
 from io import BytesIO
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
+from cmr_client import query_nasa_data
+from granule_cache import GranuleCache, file_checksum, http_fetcher
+from remote_granule import is_url
+from result_cache import ResultCache, result_key
+from centerline import geojson_geometries, geometry_hash
+from external_processor import PROCESSOR_VERSION
+from processing_pool import ProcessingPool
+from jobs import JobManager, JobQueueFull, job_key
+from batch import combine_results, process_granule
+from pipeline import run_pipeline
+from result_formats import choose_format, encode_result
+from plots import PLOT_MODES, PlotCache, plot_key, render_plot
+from binning import REDUCERS
+from tiles import TILE_ATTRIBUTES, MAX_ZOOM, CLASS_COLOURS, TileCache, render_tile, tile_in_range, tile_name
+from metrics import logger, span
 
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+# Endpoints are mounted on the application built by app.create_app
+bp = Blueprint('proxy_server', __name__)
 
-def query_nasa_data(min_lat, max_lat, min_lng, max_lng, start_date, end_date):
-    url = "https://cmr.earthdata.nasa.gov/search/granules.json"
-    page_size = 2000  # Set the maximum page size to retrieve as many results as possible
-    params = {
-        "collection_concept_id": "C2799438266-POCLOUD",
-        "bounding_box": f"{min_lng},{min_lat},{max_lng},{max_lat}",
-        "temporal": f"{start_date},{end_date}",
-        "page_size": page_size,
-    }
-    results = []
-    page_num = 1
-
-    while True:
-        params['page_num'] = page_num
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            entries = data.get('feed', {}).get('entry', [])
-            if not entries:
-                break
-            results.extend(entries)
-            if len(entries) < page_size:
-                break
-            page_num += 1
-        else:
-            raise Exception(f"Failed to retrieve data: {response.status_code}")
-
-    return {'feed': {'entry': results}}
-
-@app.route('/query', methods=['POST'])
+# Downloaded granules are kept between requests, up to GRANULE_CACHE_BYTES on disk
+GRANULE_CACHE_DIR = os.environ.get('GRANULE_CACHE_DIR', 'granule_cache')
+GRANULE_CACHE_BYTES = int(os.environ.get('GRANULE_CACHE_BYTES', 20 * 1024 ** 3))
+granule_cache = GranuleCache(GRANULE_CACHE_DIR, GRANULE_CACHE_BYTES)
+
+# Granules are fetched with DOWNLOADER_COMMAND, or, with GRANULE_FETCHER=http, straight
+# from the .nc link the client picked. With GRANULE_FETCHER=range the link is not
+# downloaded at all: only the parts of the granule near the reach are read, over HTTP
+# range requests. Multi-granule jobs run GRANULE_DOWNLOADERS
+# downloads at a time, overlapped with processing.
+DOWNLOADER_COMMAND = shlex.split(os.environ.get('DOWNLOADER_COMMAND', 'podaac-data-downloader'))
+GRANULE_FETCHER = os.environ.get('GRANULE_FETCHER', 'downloader')
+GRANULE_DOWNLOADERS = int(os.environ.get('GRANULE_DOWNLOADERS', 4))
+
+# Map tiles of processed results are kept up to TILE_CACHE_BYTES on disk, and deleted
+# with the result they were drawn from
+TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', 'tile_cache')
+TILE_CACHE_BYTES = int(os.environ.get('TILE_CACHE_BYTES', 512 * 1024 ** 2))
+tile_cache = TileCache(TILE_CACHE_DIR, TILE_CACHE_BYTES)
+
+# Results of process_data are kept between requests, up to RESULT_CACHE_BYTES on disk
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', 'result_cache')
+RESULT_CACHE_BYTES = int(os.environ.get('RESULT_CACHE_BYTES', 2 * 1024 ** 3))
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_BYTES, on_evict=tile_cache.invalidate)
+
+# Rendered plots are kept between requests, up to PLOT_CACHE_BYTES on disk
+PLOT_CACHE_DIR = os.environ.get('PLOT_CACHE_DIR', 'plot_cache')
+PLOT_CACHE_BYTES = int(os.environ.get('PLOT_CACHE_BYTES', 512 * 1024 ** 2))
+plot_cache = PlotCache(PLOT_CACHE_DIR, PLOT_CACHE_BYTES)
+
+# process_data runs in a pool of worker processes that keep the geo stack imported. The
+# server runs a single web worker (see server.py), so this is the only pool and gets every core
+PROCESSING_WORKERS = int(os.environ.get('PROCESSING_WORKERS', os.cpu_count()))
+processing_pool = None
+processing_pool_lock = threading.Lock()
+
+def get_processing_pool():
+    # Created on first use so spawned worker processes importing this module do not start pools of their own
+    global processing_pool
+    with processing_pool_lock:
+        if processing_pool is None:
+            pool = ProcessingPool(PROCESSING_WORKERS)
+            pool.warm()
+            processing_pool = pool
+    return processing_pool
+
+def warm_processing_pool():
+    # Start the processing pool in the background; /ready reports when it is up
+    threading.Thread(target=get_processing_pool, daemon=True).start()
+
+def processing_pool_ready():
+    return processing_pool is not None
+
+@bp.route('/query', methods=['POST'])
 def query_nasa():
     data = request.json
     min_lat = data['min_lat']
@@ -58,7 +93,9 @@ def query_nasa():
     end_date = data['end_date']
 
     try:
-        result = query_nasa_data(min_lat, max_lat, min_lng, max_lng, start_date, end_date)
+        with span('cmr_query') as stage:
+            result = query_nasa_data(min_lat, max_lat, min_lng, max_lng, start_date, end_date)
+            stage.rows_out = len(result.get('feed', {}).get('entry', []))
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -67,107 +104,331 @@ def query_nasa():
 
     
 
-@app.route('/download_and_process', methods=['POST'])
-def download_and_process():
-    data = request.json
-    
+def parse_process_request(data):
     # Extract the start date, end date, and bounding box from the request data
-    start_date = data.get('start_date')
-    end_date = data.get('end_date')
-    min_lat = data.get('min_lat')
-    max_lat = data.get('max_lat')
-    min_lng = data.get('min_lng')
-    max_lng = data.get('max_lng')
-    geojson_line = data.get('geojson')
-    buffer_distance = float(data.get('buffer_distance'))
-    spacing = float(data.get('spacing'))
-
-    if not start_date or not end_date or not min_lat or not max_lat or not min_lng or not max_lng:
-        return jsonify({'error': 'Missing required parameters'}), 400
-
+    params = {
+        'start_date': data.get('start_date'),
+        'end_date': data.get('end_date'),
+        'min_lat': data.get('min_lat'),
+        'max_lat': data.get('max_lat'),
+        'min_lng': data.get('min_lng'),
+        'max_lng': data.get('max_lng'),
+        'geojson': data.get('geojson'),
+        'granule_id': data.get('granule_id'),
+        'granule_url': data.get('granule_url'),
+        'plot': data.get('plot') or 'scatter',
+    }
+    if params['plot'] not in PLOT_MODES:
+        raise ValueError(f"plot must be one of {', '.join(PLOT_MODES)}")
+    # A coordinate of 0 (the equator or the prime meridian) is a value, not a missing one
+    if any(params[name] is None or params[name] == ''
+           for name in ('start_date', 'end_date', 'min_lat', 'max_lat', 'min_lng', 'max_lng')):
+        raise ValueError('Missing required parameters')
+    if not params['geojson']:
+        raise ValueError('Missing geojson')
+    try:
+        if not isinstance(json.loads(params['geojson']), dict):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError('geojson must be a GeoJSON object encoded as a string')
     try:
-        # Format the start and end dates to remove milliseconds
-        formatted_start_date = start_date.split('.')[0] + "Z"
-        formatted_end_date = end_date.split('.')[0] + "Z"
-
-        save_directory = 'tempdir'
-        if not os.path.exists(save_directory):
-            os.makedirs(save_directory)
-
-        # Create the bounding box argument as a single string
-        bounding_box = f"-b={min_lng},{min_lat},{max_lng},{max_lat}"
-
-        # Construct the podaac-data-downloader command
-        command = [
-            "podaac-data-downloader",
-            "-c", "SWOT_L2_HR_PIXC_2.0",  # Use the correct collection short name
-            "-d", save_directory,  # Specify the output directory
-            "--start-date", formatted_start_date,
-            "--end-date", formatted_end_date,
-            bounding_box  # Bounding box as a single argument
-        ]
-
-        # Run the downloader command
-        subprocess.run(command, check=True)
-        print("File downloaded successfully.")
-
-        # Assume the file is downloaded with a known file name structure, or you could iterate over files in the directory
-        downloaded_file = next(Path(save_directory).glob('*.nc'))  # Find the first .nc file in the directory
+        params['buffer_distance'] = float(data.get('buffer_distance'))
+        params['spacing'] = float(data.get('spacing'))
+    except (TypeError, ValueError):
+        raise ValueError('buffer_distance and spacing must be numbers')
+    return params
+
+def downloader_command(start_date, end_date, min_lat, max_lat, min_lng, max_lng, granule_id=None):
+    # podaac-data-downloader command for the granule cache, and the ID to cache the download under
+    # Format the start and end dates to remove milliseconds
+    formatted_start_date = start_date.split('.')[0].rstrip('Z') + "Z"
+    formatted_end_date = end_date.split('.')[0].rstrip('Z') + "Z"
+
+    # Create the bounding box argument as a single string
+    bounding_box = f"-b={min_lng},{min_lat},{max_lng},{max_lat}"
+
+    # Construct the podaac-data-downloader command; '{directory}' is filled in by the cache
+    command = DOWNLOADER_COMMAND + [
+        "-c", "SWOT_L2_HR_PIXC_2.0",  # Use the correct collection short name
+        "-d", "{directory}",  # Specify the output directory
+        "--start-date", formatted_start_date,
+        "--end-date", formatted_end_date,
+        bounding_box  # Bounding box as a single argument
+    ]
+    if granule_id:
+        command += ["--granule-name", granule_id]
+    else:
+        # Without a granule ID the query itself identifies the download
+        granule_id = f"{formatted_start_date},{formatted_end_date},{min_lng},{min_lat},{max_lng},{max_lat}"
+    return command, granule_id
 
+def open_granule(start_date, end_date, min_lat, max_lat, min_lng, max_lng, granule_id=None, granule_url=None):
+    # Context manager yielding the local path of the granule, or its URL when it is read remotely
+    if granule_url and GRANULE_FETCHER == 'range':
+        return nullcontext(granule_url)
+    command, granule_id = granule_source(start_date, end_date, min_lat, max_lat, min_lng, max_lng, granule_id, granule_url)
+    return granule_cache.open(granule_id, command)
+
+def granule_source(start_date, end_date, min_lat, max_lat, min_lng, max_lng, granule_id=None, granule_url=None):
+    # What the granule cache runs to fetch a granule, and the ID to cache it under
+    if granule_url and GRANULE_FETCHER == 'http':
+        return http_fetcher(granule_url), granule_id or Path(urlparse(granule_url).path).stem
+    return downloader_command(start_date, end_date, min_lat, max_lat, min_lng, max_lng, granule_id)
+
+def run_download_and_process(params, progress=None, attach=None):
+    # Download (or reuse) the granule, process it and render the plot; returns PNG bytes.
+    # progress, if given, is called with each stage name as it starts, and attach with
+    # the result-cache key of the processed table.
+    progress = progress or (lambda stage: None)
+    min_lat, max_lat = params['min_lat'], params['max_lat']
+    min_lng, max_lng = params['min_lng'], params['max_lng']
+    granule_id = params['granule_id']
+    buffer_distance = params['buffer_distance']
+    spacing = params['spacing']
+
+    progress('downloading')
+    with open_granule(params['start_date'], params['end_date'], min_lat, max_lat, min_lng, max_lng,
+                      granule_id, params['granule_url']) as downloaded_file, \
+            tempfile.TemporaryDirectory() as work_directory:
         # Save GeoJSON line temporarily
-        temp_geojson_file = os.path.join(save_directory, 'geojson_line.json')
+        temp_geojson_file = os.path.join(work_directory, 'geojson_line.json')
+        with open(temp_geojson_file, 'w') as f:
+            f.write(params['geojson'])
+
+        # Reuse the result of an identical earlier request, otherwise process the data in a warm worker process
+        # (a remote granule is identified by its URL, as granule files are never replaced in place)
+        granule = downloaded_file if is_url(downloaded_file) else file_checksum(downloaded_file)
+        key = result_key(granule, geometry_hash(geojson_geometries(json.loads(params['geojson']))),
+                         buffer_distance, spacing, 'within', PROCESSOR_VERSION)
+        if attach is not None:
+            attach(key)
+
+        # The same plot of the same result may already be rendered
+        png_key = plot_key(key, params['plot'])
+        png = plot_cache.get(png_key)
+        if png is not None:
+            return png, 'image/png'
+
+        df = result_cache.get(key)
+        if df is None:
+            df = get_processing_pool().process(downloaded_file, temp_geojson_file, buffer_distance, spacing,
+                                               progress=progress)
+            result_cache.put(key, df)
+
+    progress('rendering')
+    with span('render_plot', rows_in=len(df), mode=params['plot']):
+        png = render_plot(df, params['plot'])
+    plot_cache.put(png_key, png)
+    return png, 'image/png'
+
+def run_batch(params, progress=None, report=None, on_error=None):
+    # Process every granule in the request (or every granule CMR returns for its extent
+    # and dates) against one centerline; returns the long-format table. Downloads and
+    # processing overlap: each granule is processed as soon as it lands. report, if
+    # given, receives the per-stage counts, and on_error a {'granule', 'error'} dict for
+    # each granule that fails. Fails if no granule succeeds.
+    progress = progress or (lambda stage: None)
+    min_lat, max_lat = params['min_lat'], params['max_lat']
+    min_lng, max_lng = params['min_lng'], params['max_lng']
+
+    if params.get('granule_ids'):
+        urls = params.get('granule_urls') or [None] * len(params['granule_ids'])
+        granules = [(granule_id, params['start_date'], params['end_date'], url)
+                    for granule_id, url in zip(params['granule_ids'], urls)]
+    else:
+        progress('querying')
+        with span('cmr_query') as stage:
+            entries = query_nasa_data(min_lat, max_lat, min_lng, max_lng, params['start_date'], params['end_date'])['feed']['entry']
+            stage.rows_out = len(entries)
+        granules = [(entry['title'], entry['time_start'], entry['time_end'],
+                     entry['links'][0]['href'] if entry['links'] else None) for entry in entries]
+
+    def fetch(granule):
+        return open_granule(granule[1], granule[2], min_lat, max_lat, min_lng, max_lng, granule[0], granule[3])
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        temp_geojson_file = os.path.join(work_directory, 'geojson_line.json')
         with open(temp_geojson_file, 'w') as f:
-            f.write(geojson_line)
-
-        print(downloaded_file)
-        print(temp_geojson_file)
-        print(buffer_distance)
-        print(spacing)
-        
-        # Call the external Python script to process the data
-        result = subprocess.run(
-            [sys.executable, "external_processor.py", str(downloaded_file), str(temp_geojson_file), str(buffer_distance), str(spacing)],
-            capture_output=True,
-            text=True
-        )
-        print(f'result.returncode: {result.returncode}')
-        if result.returncode == 0:
-            result_json = result.stdout
-            df = pd.read_json(result_json)
-            print(df.head())
-
-            # Plot the data
-            fig = plt.figure(figsize=(15, 8))
-            ax = fig.add_subplot(111)
-
-            # Apply filter to keep points where classification is greater than 2 and not 5
-            df_filtered = df[(df['classification'] > 2) & (df['classification'] != 5)]
-
-            sc = ax.scatter(df_filtered['cumulative_distance'], df_filtered['height'], 
-                            c=df_filtered['geolocation_qual'], cmap='viridis', zorder=2, label='SWOT WSE data')
-
-            ax.legend()
-            ax.set_title('Water Surface Elevation vs Distance for selected reach')
-            ax.set_xlabel('Distance Downstream')
-            ax.set_ylabel('WSE (m)')
-
-            # Add color bar
-            cbar = plt.colorbar(sc, ax=ax)
-            cbar.set_label('Coherent Power')
-
-            # Save plot to a BytesIO object
-            img = BytesIO()
-            plt.savefig(img, format='png')
-            img.seek(0)
-
-            return send_file(img, mimetype='image/png')
-
-        else:
-            return jsonify({"error": result.stderr}), 500
+            f.write(params['geojson'])
+
+        def process(granule, path):
+            return process_granule(get_processing_pool(), path, granule[0], temp_geojson_file,
+                                   params['buffer_distance'], params['spacing'], profile=params.get('profile'))
+
+        progress('processing')
+        results = []
+        errors = []
+        for granule, result in run_pipeline(granules, fetch, process, GRANULE_DOWNLOADERS, PROCESSING_WORKERS,
+                                            report=report):
+            if isinstance(result, Exception):
+                error = {'granule': granule[0], 'error': str(result)}
+                logger.warning(json.dumps({'granule_error': granule[0], 'error': str(result)}))
+                errors.append(error)
+                if on_error is not None:
+                    on_error(error)
+                continue
+            results.append(result)
 
+    if errors and not results:
+        raise RuntimeError(f"All {len(errors)} granules failed; first error: {errors[0]['error']}")
+    return combine_results(results).reset_index()
+
+@bp.route('/download_and_process', methods=['POST'])
+def download_and_process():
+    try:
+        params = parse_process_request(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        payload, mimetype = run_download_and_process(params)
+        return send_file(BytesIO(payload), mimetype=mimetype)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Asynchronous variant of /download_and_process: POST /jobs returns a job ID at once,
+# GET /jobs/<id> reports the stage and GET /jobs/<id>/result returns the plot
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_QUEUE_DEPTH = int(os.environ.get('JOB_QUEUE_DEPTH', 32))
+job_manager = JobManager(max_workers=JOB_WORKERS, max_queue=JOB_QUEUE_DEPTH)
+
+def process_job_key(params):
+    granule = params['granule_id'] or [params[name] for name in ('start_date', 'end_date', 'min_lat', 'max_lat', 'min_lng', 'max_lng')]
+    return job_key(granule, json.loads(params['geojson']), params['buffer_distance'], params['spacing'])
+
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        params = parse_process_request(request.json)
+        key = job_key(process_job_key(params), params['plot'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job = job_manager.submit(key, lambda job, params: run_download_and_process(params, job.update, job.attach),
+                                 params)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(job.to_dict()), 202
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 409
+    if isinstance(job.result, pd.DataFrame):
+        # Tables are encoded on the way out in the format the client asks for
+        try:
+            fmt = choose_format(request.accept_mimetypes, request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        payload, mimetype = encode_result(job.result, fmt)
+    else:
+        payload, mimetype = job.result
+    return send_file(BytesIO(payload), mimetype=mimetype)
+
+# Map tiles of the clipped pixels behind a finished /jobs job, for a Leaflet tile layer:
+# GET /jobs/<id>/tiles.json describes them (TileJSON, with the colour scale of each
+# attribute) and GET /jobs/<id>/tiles/<attribute>/<z>/<x>/<y>.png returns one tile.
+def job_tile_index(job_id):
+    # (job, TileIndex) of a finished job, or (None, error response)
+    job = job_manager.get(job_id)
+    if job is None:
+        return None, (jsonify({'error': 'Unknown job'}), 404)
+    if job.status == 'failed':
+        return None, (jsonify({'error': job.error}), 500)
+    if job.status != 'done':
+        return None, (jsonify(job.to_dict()), 409)
+    if job.result_key is None:
+        return None, (jsonify({'error': 'This job has no map tiles'}), 404)
+    index = tile_cache.index(job.result_key, lambda: result_cache.get(job.result_key))
+    if index is None:
+        return None, (jsonify({'error': 'The result of this job is no longer cached; submit it again'}), 410)
+    return job, index
+
+@bp.route('/jobs/<job_id>/tiles.json', methods=['GET'])
+def job_tilejson(job_id):
+    job, index = job_tile_index(job_id)
+    if job is None:
+        return index
+    base = request.host_url.rstrip('/')
+    attributes = {}
+    for attribute in TILE_ATTRIBUTES:
+        if attribute not in index.attributes:
+            continue
+        attributes[attribute] = {'tiles': [f'{base}/jobs/{job_id}/tiles/{attribute}/{{z}}/{{x}}/{{y}}.png']}
+        if attribute == 'classification':
+            attributes[attribute]['colours'] = CLASS_COLOURS
+        elif attribute in index.ranges:
+            attributes[attribute]['range'] = index.ranges[attribute]
+    return jsonify({
+        'tilejson': '3.0.0',
+        'tiles': attributes.get('height', {}).get('tiles', []),
+        'minzoom': 0,
+        'maxzoom': MAX_ZOOM,
+        'bounds': index.bounds,
+        'pixels': len(index),
+        'attributes': attributes,
+    })
+
+@bp.route('/jobs/<job_id>/tiles/<attribute>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def job_tile(job_id, attribute, z, x, y):
+    if attribute not in TILE_ATTRIBUTES:
+        return jsonify({'error': f"attribute must be one of {', '.join(TILE_ATTRIBUTES)}"}), 400
+    if not tile_in_range(z, x, y):
+        return jsonify({'error': 'No such tile'}), 404
+    job, index = job_tile_index(job_id)
+    if job is None:
+        return index
+
+    name = tile_name(job.result_key, attribute, z, x, y)
+    png = tile_cache.get(name)
+    if png is None:
+        with span('render_tile', rows_in=len(index), zoom=z):
+            png = render_tile(index, attribute, z, x, y)
+        tile_cache.put(name, png)
+    return send_file(BytesIO(png), mimetype='image/png')
+
+# Time series over many granules: POST /batch takes the /jobs parameters plus an optional
+# granule_ids list, with their .nc links in granule_urls if known (otherwise every granule
+# CMR finds is used), and returns a job whose result is a table of (granule_time, station)
+# rows, as JSON, Arrow, Parquet or .npz. With profile set to a reducer (median, mean,
+# trimmed_mean, weighted_mean or mad) the rows are each granule's binned water surface
+# profile instead of its pixels. GET /jobs/<id> reports per-stage progress.
+@bp.route('/batch', methods=['POST'])
+def submit_batch():
+    try:
+        params = parse_process_request(request.json)
+        params['granule_ids'] = request.json.get('granule_ids') or []
+        params['granule_urls'] = request.json.get('granule_urls') or []
+        if params['granule_urls'] and len(params['granule_urls']) != len(params['granule_ids']):
+            raise ValueError('granule_urls must match granule_ids')
+        params['profile'] = request.json.get('profile')
+        if params['profile'] is not None and params['profile'] not in REDUCERS:
+            raise ValueError(f"profile must be one of {', '.join(REDUCERS)}")
+        key = job_key('batch', params['granule_ids'], process_job_key(params), params['profile'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job = job_manager.submit(key, lambda job, params: run_batch(params, job.update, job.report, job.add_error),
+                                 params)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(job.to_dict()), 202
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    from app import create_app
+    create_app().run(debug=True)
@@ -0,0 +1,234 @@
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import requests
+
+import metrics
+
+
+# Read a PIXC granule in place over HTTP range requests instead of downloading it.
+#
+# RangeFile is a seekable, read-only file object over a URL. h5py reads the HDF5
+# metadata and only the chunks it is asked for through it, so process_data fetches the
+# latitude/longitude chunks, and then only the chunks of the other variables that hold
+# pixels inside the buffer envelope. Reads are served from fixed-size blocks; missing
+# blocks are fetched with one Range request per run and kept in a shared LRU block
+# cache, so a range is not fetched twice. RemoteDataset exposes the h5py file through
+# the part of the netCDF4 API that process_data uses, with netCDF4's masking and
+# scaling applied. How much of the file was fetched is reported on a 'remote_granule'
+# metrics span when it is closed.
+
+BLOCK_SIZE = 256 * 1024
+
+def is_url(path):
+    return str(path).startswith(('http://', 'https://'))
+
+class BlockCache:
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._blocks = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+            return block
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._bytes = 0
+
+    def put(self, key, block):
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self._bytes += len(block)
+            while self._bytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self._bytes -= len(evicted)
+
+block_cache = BlockCache()
+
+class RangeFile(io.RawIOBase):
+    def __init__(self, url, session=None, block_size=BLOCK_SIZE, cache=block_cache, timeout=60):
+        self.url = url
+        self.session = session or requests.Session()
+        self.block_size = block_size
+        self.cache = cache
+        self.timeout = timeout
+        self.position = 0
+        self.bytes_transferred = 0
+        self.requests = 0
+
+        response = self.session.head(url, allow_redirects=True, timeout=timeout)
+        response.raise_for_status()
+        self.size = int(response.headers['Content-Length'])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def _fetch(self, first, last):
+        # One Range request for blocks first..last, split into blocks for the cache
+        start, stop = first * self.block_size, min(self.size, (last + 1) * self.block_size)
+        response = self.session.get(self.url, headers={'Range': f'bytes={start}-{stop - 1}'}, timeout=self.timeout)
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise ValueError(f"Server ignored the range request for {self.url}")
+        data = response.content
+        self.requests += 1
+        self.bytes_transferred += len(data)
+        blocks = {}
+        for block in range(first, last + 1):
+            offset = (block - first) * self.block_size
+            blocks[block] = data[offset:offset + self.block_size]
+            self.cache.put((self.url, self.block_size, block), blocks[block])
+        return blocks
+
+    def readinto(self, buffer):
+        stop = min(self.size, self.position + len(buffer))
+        if stop <= self.position:
+            return 0
+        first, last = self.position // self.block_size, (stop - 1) // self.block_size
+
+        blocks = {}
+        missing = []
+        for block in range(first, last + 1):
+            cached = self.cache.get((self.url, self.block_size, block))
+            if cached is None:
+                missing.append(block)
+            else:
+                blocks[block] = cached
+        # Fetch each run of consecutive missing blocks in one request
+        while missing:
+            run = 1
+            while run < len(missing) and missing[run] == missing[0] + run:
+                run += 1
+            blocks.update(self._fetch(missing[0], missing[run - 1]))
+            missing = missing[run:]
+
+        data = b''.join(blocks[block] for block in range(first, last + 1))
+        offset = self.position - first * self.block_size
+        length = stop - self.position
+        buffer[:length] = data[offset:offset + length]
+        self.position = stop
+        return length
+
+    def stats(self):
+        return {'url': self.url, 'file_size': self.size, 'bytes_transferred': self.bytes_transferred,
+                'requests': self.requests}
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, np.ndarray) and value.size == 1:
+        return _decode(value.item())
+    return value
+
+class RemoteVariable:
+    def __init__(self, dataset):
+        self._dataset = dataset
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+
+    def chunking(self):
+        return list(self._dataset.chunks) if self._dataset.chunks else 'contiguous'
+
+    def __getitem__(self, key):
+        # Masked like netCDF4: fill values, missing values, values outside the valid range
+        # and NaNs; then scale_factor/add_offset are applied
+        data = self._dataset[key]
+        attrs = self._dataset.attrs
+        mask = np.zeros(data.shape, dtype=bool)
+        for name in ('_FillValue', 'missing_value'):
+            if name in attrs:
+                mask |= np.isin(data, np.atleast_1d(attrs[name]))
+        valid_min, valid_max = attrs.get('valid_min'), attrs.get('valid_max')
+        if 'valid_range' in attrs:
+            valid_min, valid_max = attrs['valid_range']
+        if valid_min is not None:
+            mask |= data < valid_min
+        if valid_max is not None:
+            mask |= data > valid_max
+        if data.dtype.kind == 'f':
+            mask |= np.isnan(data)
+
+        if 'scale_factor' in attrs or 'add_offset' in attrs:
+            data = data * attrs.get('scale_factor', 1) + attrs.get('add_offset', 0)
+        return np.ma.masked_array(data, mask=mask)
+
+class RemoteGroup:
+    def __init__(self, group):
+        import h5py
+        self.variables = {name: RemoteVariable(item) for name, item in group.items()
+                          if isinstance(item, h5py.Dataset) and 'CLASS' not in item.attrs}
+
+class RemoteDataset:
+    def __init__(self, url, session=None, block_size=BLOCK_SIZE, cache=block_cache):
+        # h5py is only imported for remote granules
+        import h5py
+        self.file = RangeFile(url, session, block_size, cache)
+        self._h5 = h5py.File(self.file, 'r')
+        self.groups = {name: RemoteGroup(item) for name, item in self._h5.items() if isinstance(item, h5py.Group)}
+
+    def ncattrs(self):
+        return [name for name in self._h5.attrs if not name.startswith('_')]
+
+    def getncattr(self, name):
+        return _decode(self._h5.attrs[name])
+
+    def stats(self):
+        return self.file.stats()
+
+    def close(self):
+        # A span, so the fetch stats reach the web process's registry from pool workers
+        # like any stage (pixc_remote_fetched_ratio) and are logged with it
+        with metrics.span('remote_granule', url=self.file.url) as stage:
+            self._h5.close()
+            stats = self.stats()
+            stage.fields.update(file_size=stats['file_size'], bytes_transferred=stats['bytes_transferred'],
+                                requests=stats['requests'],
+                                fetched_ratio=stats['bytes_transferred'] / max(stats['file_size'], 1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def start_time(dataset):
+    # Start time of an open granule from its global attributes, NaT if it has none
+    for name in ('time_granule_start', 'time_coverage_start'):
+        if name in dataset.ncattrs():
+            return pd.Timestamp(str(dataset.getncattr(name)).rstrip('Z'))
+    return pd.NaT
+
+def open_granule(path, memory=None):
+    # netCDF4 Dataset for a local granule (or, given memory, one held in memory named
+    # path), RemoteDataset for an http(s) URL
+    if is_url(path) and memory is None:
+        return RemoteDataset(str(path))
+    from netCDF4 import Dataset
+    return Dataset(path, 'r', memory=memory)
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+import metrics
+from granule_cache import evict_lru
+
+
+# On-disk cache of process_data results stored as Parquet.
+#
+# Entries are keyed by result_key: the granule checksum, a hash of the centerline
+# geometry, the buffer distance, the spacing, the clip mode and the processor version,
+# so a change to any input or to the processing code misses. Writes go through a
+# temporary file and an atomic rename. Once the cache grows past max_bytes the least
+# recently used entries are deleted, and on_evict, if given, is called with each key
+# deleted, so views derived from a result (map tiles) go with it.
+
+def result_key(granule_checksum, geometry_hash, buffer_distance, spacing, clip_mode, processor_version):
+    parts = [granule_checksum, geometry_hash, float(buffer_distance), float(spacing), clip_mode, processor_version]
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+class ResultCache:
+    def __init__(self, directory, max_bytes, on_evict=None):
+        self.directory = Path(directory)
+        self.max_bytes = int(max_bytes)
+        self.on_evict = on_evict
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return self.directory / f'{key}.parquet'
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            result = pd.read_parquet(path)
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            metrics.cache_lookup('result', False)
+            return None
+        with self._lock:
+            self.hits += 1
+        metrics.cache_lookup('result', True)
+        return result
+
+    def put(self, key, result):
+        fd, temp_path = tempfile.mkstemp(prefix='.staging-', suffix='.parquet', dir=self.directory)
+        os.close(fd)
+        try:
+            result.to_parquet(temp_path, index=False)
+            os.replace(temp_path, self.path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        with self._lock:
+            evicted = evict_lru(self.directory, '*.parquet', self.max_bytes, keep={key})
+        for evicted_key in evicted:
+            if self.on_evict is not None:
+                self.on_evict(evicted_key)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,112 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+
+# Wire formats for process_data results.
+#
+# Arrow IPC stream, Parquet and NumPy .npz carry the columns as binary buffers; JSON
+# (DataFrame.to_json) is kept as the fallback for existing clients. Before encoding,
+# columns whose range is fixed by the PIXC product are downcast: classification to
+# int8, the power and fraction variables to float32, the indices to int32. Integer
+# columns stay nullable, since stations without a matching pixel have no values.
+
+FORMATS = {
+    'json': 'application/json',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+    'npz': 'application/x-npz',
+}
+
+DOWNCAST = {
+    'height': 'float32',
+    'water_frac': 'float32',
+    'coherent_power': 'float32',
+    'missed_detection_rate': 'float32',
+    'classification': 'Int8',
+    'geolocation_qual': 'UInt32',
+    'index_right': 'Int32',
+    'nearest_index': 'Int32',
+    'station': 'Int32',
+}
+
+def downcast(df):
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if col in DOWNCAST:
+            try:
+                values = values.astype(DOWNCAST[col])
+            except (TypeError, ValueError, OverflowError):
+                # Values outside the target range: leave the column as it is
+                pass
+        columns[col] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def choose_format(accept_mimetypes, requested=None):
+    # Pick a format from an explicit ?format= value or the Accept header, defaulting to JSON.
+    # Only a mimetype the header names exactly counts: curl, requests, fetch() and
+    # browsers send */* (or application/*), which must get JSON, not the first binary
+    # format that a wildcard happens to match.
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unknown format: {requested}")
+        return requested
+    names = {mimetype: name for name, mimetype in FORMATS.items()}
+    for mimetype, quality in accept_mimetypes:
+        if quality > 0 and mimetype in names:
+            return names[mimetype]
+    return 'json'
+
+def encode_result(df, fmt='json'):
+    # Returns (payload bytes, mimetype)
+    if fmt == 'json':
+        return df.to_json().encode('utf-8'), FORMATS['json']
+
+    # Point geometries are not carried in the binary formats; latitude/longitude are
+    df = downcast(pd.DataFrame(df).drop(columns=['geometry'], errors='ignore').reset_index(drop=True))
+    buffer = io.BytesIO()
+    if fmt == 'arrow':
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+    elif fmt == 'parquet':
+        df.to_parquet(buffer, index=False)
+    elif fmt == 'npz':
+        # Nullable columns are stored as their values plus a '<name>.mask' array
+        arrays = {}
+        for col in df.columns:
+            values = df[col]
+            if isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+                arrays[f'{col}.mask'] = values.isna().to_numpy()
+                values = values.fillna(0).to_numpy(values.dtype.numpy_dtype)
+            arrays[col] = np.asarray(values)
+        np.savez(buffer, **arrays)
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    return buffer.getvalue(), FORMATS[fmt]
+
+def decode_result(payload, fmt='json'):
+    if fmt == 'json':
+        return pd.read_json(io.StringIO(payload.decode('utf-8')))
+
+    buffer = io.BytesIO(payload)
+    if fmt == 'arrow':
+        import pyarrow as pa
+        return pa.ipc.open_stream(buffer).read_pandas()
+    if fmt == 'parquet':
+        return pd.read_parquet(buffer)
+    if fmt == 'npz':
+        with np.load(buffer) as arrays:
+            columns = {}
+            for name in arrays.files:
+                if name.endswith('.mask'):
+                    continue
+                values = arrays[name]
+                if f'{name}.mask' in arrays.files:
+                    values = pd.arrays.IntegerArray(values, arrays[f'{name}.mask'])
+                columns[name] = values
+        return pd.DataFrame(columns)
+    raise ValueError(f"Unknown format: {fmt}")
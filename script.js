@@ -19,7 +19,10 @@ const baseLayers = {
     "Satellite": satelliteTiles
 };
 
-L.control.layers(baseLayers).addTo(map);
+const layerControl = L.control.layers(baseLayers).addTo(map);
+
+// Overlays of the clipped pixels of the last processed job, one per attribute
+let pixelLayers = {};
 
 // Track the drawing state
 let drawingMode = false;
@@ -181,7 +184,8 @@ document.getElementById('process-button').addEventListener('click', () => {
         return;
     }
 
-    fetch('http://localhost:5000/download_and_process', {
+    // Submit the work as a background job and poll until the plot is ready
+    fetch('http://localhost:5000/jobs', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -193,15 +197,22 @@ document.getElementById('process-button').addEventListener('click', () => {
             max_lat: selectedMaxLat,
             min_lng: selectedMinLng,
             max_lng: selectedMaxLng,
+            granule_id: selectedNetCDFLink.split('/').pop().replace(/\.nc$/, ''),  // Granule UR, used as the cache key
+            granule_url: selectedNetCDFLink,  // Fetched directly when the server runs with GRANULE_FETCHER=http
             geojson: JSON.stringify(geoJsonLine),
             buffer_distance: bufferDistance,
             spacing: spacing
         })
     })
     .then(response => {
+        if (response.status === 429) throw new Error('The server is busy, please try again shortly.');
         if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-        return response.blob();  // Get the response as a Blob (binary large object)
+        return response.json();
     })
+    .then(job => waitForJob(job.id).then(imageBlob => {
+        showPixelTiles(job.id);
+        return imageBlob;
+    }))
     .then(imageBlob => {
         // Create a URL for the image blob
         const imageObjectURL = URL.createObjectURL(imageBlob);
@@ -214,6 +225,55 @@ document.getElementById('process-button').addEventListener('click', () => {
     });
 });
 
+// Poll a processing job until it finishes, then fetch its plot as a Blob
+function waitForJob(jobId) {
+    return fetch(`http://localhost:5000/jobs/${jobId}`)
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            return response.json();
+        })
+        .then(job => {
+            console.log(`Job ${jobId}: ${job.status}`);
+            if (job.status === 'failed') throw new Error(job.error);
+            if (job.status !== 'done') {
+                return new Promise(resolve => setTimeout(resolve, 2000)).then(() => waitForJob(jobId));
+            }
+            return fetch(`http://localhost:5000/jobs/${jobId}/result`).then(response => {
+                if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+                return response.blob();  // Get the response as a Blob (binary large object)
+            });
+        });
+}
+
+// Replace the pixel overlays with the map tiles of a finished job; height is shown,
+// the other attributes can be switched on from the layer control
+function showPixelTiles(jobId) {
+    fetch(`http://localhost:5000/jobs/${jobId}/tiles.json`)
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            return response.json();
+        })
+        .then(tilejson => {
+            Object.values(pixelLayers).forEach(layer => {
+                layerControl.removeLayer(layer);
+                map.removeLayer(layer);
+            });
+            pixelLayers = {};
+            Object.entries(tilejson.attributes).forEach(([attribute, source]) => {
+                const range = source.range ? ` (${source.range.map(value => value.toFixed(2)).join(' to ')})` : '';
+                const layer = L.tileLayer(source.tiles[0], {
+                    minZoom: tilejson.minzoom,
+                    maxZoom: 19,
+                    opacity: 0.9
+                });
+                pixelLayers[attribute] = layer;
+                layerControl.addOverlay(layer, `Pixels: ${attribute}${range}`);
+            });
+            if (pixelLayers.height) pixelLayers.height.addTo(map);
+        })
+        .catch(error => console.error('Error loading pixel tiles:', error));
+}
+
 
 
 // // Define selectedNetCDFLink globally
@@ -1,54 +1,82 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import requests
-
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-def query_nasa_data(min_lat, max_lat, min_lng, max_lng, start_date, end_date):
-    url = "https://cmr.earthdata.nasa.gov/search/granules.json"
-    page_size = 2000  # Set the maximum page size to retrieve as many results as possible
-    params = {
-        "collection_concept_id": "C2799438266-POCLOUD",
-        "bounding_box": f"{min_lng},{min_lat},{max_lng},{max_lat}",
-        "temporal": f"{start_date},{end_date}",
-        "page_size": page_size,
-    }
-    results = []
-    page_num = 1
-
-    while True:
-        params['page_num'] = page_num
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            entries = data.get('feed', {}).get('entry', [])
-            if not entries:
-                break
-            results.extend(entries)
-            if len(entries) < page_size:
-                break
-            page_num += 1
-        else:
-            raise Exception(f"Failed to retrieve data: {response.status_code}")
-
-    return {'feed': {'entry': results}}
-
-@app.route('/query', methods=['POST'])
-def query_nasa():
-    data = request.json
-    min_lat = data['min_lat']
-    max_lat = data['max_lat']
-    min_lng = data['min_lng']
-    max_lng = data['max_lng']
-    start_date = data['start_date']
-    end_date = data['end_date']
+import argparse
+import logging
+import os
 
-    try:
-        result = query_nasa_data(min_lat, max_lat, min_lng, max_lng, start_date, end_date)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+# Production launcher for app.create_app().
+#
+# The app is served by gunicorn with threaded workers. It is loaded in the gunicorn
+# master before the workers are forked (preload_app), so the geo stack the endpoint
+# modules import is shared copy-on-write between workers rather than imported once per
+# worker. The worker then starts the processing pool in the background, and GET /ready
+# answers 503 until it is up. Without gunicorn the app runs on Werkzeug's threaded server.
+#
+# There is one worker: the JobManager behind /jobs and /batch keeps job state in the
+# memory of the process that accepted the job, so with several workers polling a job
+# would fail whenever the request reached another one, and each worker would start a
+# processing pool of PROCESSING_WORKERS processes of its own. Requests are served
+# concurrently by the worker's threads, and processed in parallel by the pool.
+#
+#   python server.py --threads 8 --bind 0.0.0.0:5000
+
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 1))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+WEB_BIND = os.environ.get('WEB_BIND', '127.0.0.1:5000')
+# Synchronous /download_and_process requests can take minutes
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 600))
+# Stage spans and request timings are logged as JSON lines at INFO (see metrics)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+def post_fork(server, worker):
+    import proxy_server
+    proxy_server.warm_processing_pool()
+
+def serve(workers=WEB_WORKERS, threads=WEB_THREADS, bind=WEB_BIND, timeout=WEB_TIMEOUT):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for name, value in {
+                'bind': bind,
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread',
+                'timeout': timeout,
+                'preload_app': True,
+                'post_fork': post_fork,
+            }.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            from app import create_app
+            return create_app()
+
+    Application().run()
+
+def serve_dev(threads, bind):
+    import proxy_server
+    from app import create_app
+
+    host, _, port = bind.rpartition(':')
+    app = create_app()
+    proxy_server.warm_processing_pool()
+    app.run(host=host or '127.0.0.1', port=int(port), threaded=threads > 1)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS)
+    parser.add_argument('--threads', type=int, default=WEB_THREADS)
+    parser.add_argument('--bind', default=WEB_BIND)
+    parser.add_argument('--timeout', type=int, default=WEB_TIMEOUT)
+    args = parser.parse_args()
+    if args.workers != 1:
+        parser.error('--workers must be 1: job state is kept in the worker process (use --threads for concurrency)')
+    logging.basicConfig(level=LOG_LEVEL, format='%(message)s')
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("gunicorn is not installed; serving with Werkzeug's threaded server in a single process")
+        serve_dev(args.threads, args.bind)
+    else:
+        serve(args.workers, args.threads, args.bind, args.timeout)
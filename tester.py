@@ -2,10 +2,12 @@ import sys
 import geopandas as gpd
 import pandas as pd
 import xarray as xr
-from shapely.geometry import MultiPoint, LineString
+from shapely.geometry import LineString
 from netCDF4 import Dataset
 import numpy as np
 from scipy.spatial import cKDTree
+from centerline import resample_centerline
+from projection import extent_epsg, to_utm
 
 def process_data(netcdf_path, geojson_path, buffer_distance, spacing):
     # Load NetCDF file
@@ -40,31 +42,19 @@ def process_data(netcdf_path, geojson_path, buffer_distance, spacing):
 
     # Convert GeoJSON line to GeoDataFrame
     geojson_gdf = gpd.read_file(geojson_path)
-    river = geojson_gdf.to_crs('EPSG:32718')
+    epsg_code = extent_epsg(latitude.min(), latitude.max(), longitude.min(), longitude.max())
+    river = geojson_gdf.to_crs(epsg_code)
 
     # Buffer the line
     river_buffered = river.buffer(buffer_distance, cap_style='flat')
     river_buffered_gdf = gpd.GeoDataFrame(geometry=river_buffered, crs=river.crs)
 
-    # Interpolate points along the line
-    def interpolate_points(line, distance):
-        num_points = int(line.length / distance)
-        return MultiPoint([line.interpolate(i * distance) for i in range(num_points + 1)])
-
-    # Apply interpolation
-    points_gdf = river.geometry.apply(lambda x: interpolate_points(x, spacing))
-    points_gdf = points_gdf.explode(index_parts=True).reset_index(drop=True)
-    river_points = gpd.GeoDataFrame(geometry=points_gdf)
-
-    # Calculate cumulative distance
-    def calculate_cumulative_distance(gdf):
-        gdf['prev_geometry'] = gdf['geometry'].shift()
-        gdf['distance_to_prev'] = gdf.apply(lambda row: row['geometry'].distance(row['prev_geometry']) if pd.notna(row['prev_geometry']) else 0, axis=1)
-        gdf['cumulative_distance'] = gdf['distance_to_prev'].cumsum()
-        return gdf
-
-    river = calculate_cumulative_distance(river_points)
-    river.reset_index(drop=True, inplace=True)
+    # Resample stations along the line and compute chainage
+    stations, distance_to_prev, cumulative_distance = resample_centerline(river.geometry, spacing)
+    river = gpd.GeoDataFrame({
+        'distance_to_prev': distance_to_prev,
+        'cumulative_distance': cumulative_distance
+    }, geometry=gpd.points_from_xy(stations[:, 0], stations[:, 1]), crs=river.crs)
 
     river_cum_dis = river['cumulative_distance'].values
 
@@ -84,8 +74,8 @@ def process_data(netcdf_path, geojson_path, buffer_distance, spacing):
     ds_clipped = gpd.sjoin(ds_gdf, river_buffered_gdf, how='inner', predicate='within')
 
     # Find nearest river point to each ds point
-    river = river.to_crs('EPSG:32718')  # You may need to dynamically determine the EPSG code
-    ds_coords_utm = np.column_stack((ds_clipped.geometry.x, ds_clipped.geometry.y))
+    ds_coords_utm = np.column_stack(to_utm(ds_clipped['longitude'].to_numpy(dtype=float),
+                                           ds_clipped['latitude'].to_numpy(dtype=float), epsg_code))
     river_coords_utm = np.column_stack((river.geometry.x, river.geometry.y))
     tree_river = cKDTree(river_coords_utm)
 
@@ -0,0 +1,227 @@
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+
+import numpy as np
+
+import metrics
+from plots import PlotCache
+
+
+# Map tiles of the clipped pixels of a processed result, for a Leaflet tile layer.
+#
+# Tiles are 256 x 256 PNGs in the Web Mercator XYZ scheme, drawn on the server with each
+# pixel coloured by one attribute, so a tile costs the same to send whether it covers ten
+# pixels or ten million. A TileIndex is built once per result: the pixels are projected
+# to Web Mercator and sorted by their Morton (Z-order) code at INDEX_ZOOM, which makes it
+# an implicit quadtree, as the pixels of any tile at any zoom are one contiguous run of
+# the sorted codes, found with two binary searches. Tiles holding more than
+# MAX_TILE_POINTS pixels are drawn from an even sample of the run, which in Z-order is
+# spread evenly over the tile. Colour scales are fixed per result, so tiles match.
+#
+# Rendered tiles are kept in a TileCache named after the result-cache key, so they are
+# only reused for the same result, and are deleted with it when the result cache evicts
+# it (see ResultCache's on_evict).
+
+TILE_SIZE = 256
+MAX_ZOOM = 22
+INDEX_ZOOM = 24
+MAX_TILE_POINTS = int(os.environ.get('MAX_TILE_POINTS', 250_000))
+# Drawn size of a pixel on the ground, so pixels grow into squares when zoomed in
+PIXEL_METRES = 20.0
+MAX_POINT_SIZE = 8
+EARTH_CIRCUMFERENCE = 40_075_016.686
+
+# Attributes tiles can be coloured by; classification uses CLASS_COLOURS, the others a
+# colour ramp over the 2nd to 98th percentile of the result's values
+TILE_ATTRIBUTES = ('height', 'classification', 'water_frac', 'coherent_power')
+CLASS_COLOURS = {
+    1: '#c8b27d',  # land
+    2: '#a6865a',  # land_near_water
+    3: '#7fc8f8',  # water_near_land
+    4: '#1f63c6',  # open_water
+    5: '#102a5c',  # dark_water
+    6: '#4fd1c5',  # low_coh_water_near_land
+    7: '#1a8f83',  # open_low_coh_water
+}
+
+def to_mercator(longitude, latitude):
+    # Web Mercator position as a fraction of the world, (0, 0) at the top left
+    latitude = np.clip(latitude, -85.05112878, 85.05112878)
+    mx = (np.asarray(longitude, dtype=float) + 180.0) / 360.0
+    my = (1.0 - np.log(np.tan(np.radians(latitude)) + 1.0 / np.cos(np.radians(latitude))) / np.pi) / 2.0
+    return np.clip(mx, 0, np.nextafter(1, 0)), np.clip(my, 0, np.nextafter(1, 0))
+
+def _spread_bits(values):
+    # Bits of 32-bit integers moved to the even bit positions of 64-bit ones
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+def morton_code(x, y):
+    return _spread_bits(np.asarray(x)) | (_spread_bits(np.asarray(y)) << np.uint64(1))
+
+def hex_colour(colour):
+    return [int(colour[i:i + 2], 16) for i in (1, 3, 5)] + [255]
+
+class TileIndex:
+    # The pixels of a result in Z-order, with the attributes tiles are coloured by
+    def __init__(self, df):
+        longitude = df['longitude'].to_numpy(dtype=float)
+        latitude = df['latitude'].to_numpy(dtype=float)
+        # Stations without pixels come back from the merge with NaN coordinates
+        valid = np.isfinite(longitude) & np.isfinite(latitude)
+        mx, my = to_mercator(longitude[valid], latitude[valid])
+        scale = 1 << INDEX_ZOOM
+        codes = morton_code((mx * scale).astype(np.int64), (my * scale).astype(np.int64))
+        order = np.argsort(codes, kind='stable')
+
+        self.codes = codes[order]
+        self.mx, self.my = mx[order], my[order]
+        self.attributes = {name: df[name].to_numpy(dtype=float)[valid][order]
+                           for name in TILE_ATTRIBUTES if name in df.columns}
+        self.ranges = {}
+        for name, values in self.attributes.items():
+            finite = values[np.isfinite(values)]
+            if name != 'classification' and len(finite):
+                self.ranges[name] = tuple(float(v) for v in np.percentile(finite, [2, 98]))
+        self.bounds = None
+        if len(self.mx):
+            # [west, south, east, north] in degrees, as TileJSON has it
+            west, east = self.mx.min() * 360 - 180, self.mx.max() * 360 - 180
+            north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * self.my.min()))))
+            south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * self.my.max()))))
+            self.bounds = [west, south, east, north]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def tile_rows(self, z, x, y):
+        # Positions of the pixels inside tile (z, x, y), at most MAX_TILE_POINTS of them
+        shift = np.uint64(2 * (INDEX_ZOOM - z))
+        first = morton_code(np.array([x]), np.array([y]))[0]
+        start, stop = np.searchsorted(self.codes, [first << shift, (first + np.uint64(1)) << shift])
+        if stop - start > MAX_TILE_POINTS:
+            return np.linspace(start, stop - 1, MAX_TILE_POINTS).astype(np.intp)
+        return np.arange(start, stop)
+
+def tile_in_range(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+def colour_ramp():
+    # 256 RGBA colours of the viridis ramp; matplotlib is only imported to draw tiles
+    from matplotlib import colormaps
+    return (colormaps['viridis'](np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+def point_size(z, latitude):
+    # Side in screen pixels of the square a pixel is drawn as at zoom z
+    metres_per_pixel = EARTH_CIRCUMFERENCE * math.cos(math.radians(latitude)) / (TILE_SIZE << z)
+    return int(min(MAX_POINT_SIZE, max(1, round(PIXEL_METRES / metres_per_pixel))))
+
+def encode_png(rgba):
+    from matplotlib.image import imsave
+    buffer = BytesIO()
+    imsave(buffer, rgba, format='png')
+    return buffer.getvalue()
+
+def render_tile(index, attribute, z, x, y):
+    # PNG bytes of tile (z, x, y) with the pixels coloured by attribute; transparent where empty
+    if attribute not in TILE_ATTRIBUTES:
+        raise ValueError(f"attribute must be one of {', '.join(TILE_ATTRIBUTES)}")
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    rows = index.tile_rows(z, x, y)
+    values = index.attributes.get(attribute)
+    if values is not None and len(rows):
+        values = values[rows]
+        if attribute == 'classification':
+            palette = np.zeros((256, 4), dtype=np.uint8)
+            for value, colour in CLASS_COLOURS.items():
+                palette[value] = hex_colour(colour)
+            known = np.isfinite(values)
+            colours = palette[np.where(known, values, 0).astype(np.uint8)]
+        else:
+            low, high = index.ranges.get(attribute, (0.0, 1.0))
+            known = np.isfinite(values)
+            scaled = np.clip((np.where(known, values, low) - low) / ((high - low) or 1.0), 0, 1)
+            colours = colour_ramp()[(scaled * 255).astype(np.intp)]
+        colours[~known, 3] = 0
+
+        scale = TILE_SIZE << z
+        px = (index.mx[rows] * scale - x * TILE_SIZE).astype(np.intp)
+        py = (index.my[rows] * scale - y * TILE_SIZE).astype(np.intp)
+        latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / (1 << z)))))
+        size = point_size(z, latitude)
+        drawn = colours[:, 3] > 0
+        for dy in range(size):
+            for dx in range(size):
+                cx, cy = px + dx - size // 2, py + dy - size // 2
+                inside = drawn & (cx >= 0) & (cx < TILE_SIZE) & (cy >= 0) & (cy < TILE_SIZE)
+                rgba[cy[inside], cx[inside]] = colours[inside]
+    return encode_png(rgba)
+
+def tile_name(result_key, attribute, z, x, y):
+    return f'{result_key}-{attribute}-{z}-{x}-{y}'
+
+class TileCache(PlotCache):
+    # Rendered tiles on disk, as PlotCache keeps plots, and the TileIndex of the most
+    # recently used results in memory. Each index is built by one request: the others
+    # asking for it meanwhile (Leaflet asks for a screenful of tiles at once) wait for
+    # that build instead of reading the result and sorting its pixels again.
+    name = 'tile'
+
+    def __init__(self, directory, max_bytes, max_indexes=8):
+        super().__init__(directory, max_bytes)
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()
+        self._building = {}
+
+    def index(self, result_key, load):
+        # TileIndex of a result, built from load() (the result table, or None if it is gone)
+        with self._lock:
+            if result_key in self._indexes:
+                self._indexes.move_to_end(result_key)
+                return self._indexes[result_key]
+            building = self._building.get(result_key)
+            if building is not None:
+                owner = False
+            else:
+                building = self._building[result_key] = Future()
+                owner = True
+        if not owner:
+            return building.result()
+
+        try:
+            index = self._build(load)
+        except Exception as e:
+            with self._lock:
+                self._building.pop(result_key, None)
+            building.set_exception(e)
+            raise
+        with self._lock:
+            self._building.pop(result_key, None)
+            if index is not None:
+                self._indexes[result_key] = index
+                while len(self._indexes) > self.max_indexes:
+                    self._indexes.popitem(last=False)
+        building.set_result(index)
+        return index
+
+    def _build(self, load):
+        df = load()
+        if df is None:
+            return None
+        with metrics.span('tile_index', rows_in=len(df)) as stage:
+            index = TileIndex(df)
+            stage.rows_out = len(index)
+        return index
+
+    def invalidate(self, result_key):
+        # Forget a result's index and delete its tiles
+        with self._lock:
+            self._indexes.pop(result_key, None)
+            for path in self.directory.glob(f'{result_key}-*.png'):
+                path.unlink(missing_ok=True)